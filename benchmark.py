@@ -0,0 +1,974 @@
+# Benchmarks for the ship decoding pipeline
+# run with: python benchmark.py
+#   every benchmark first checks that the optimized code gives the same result
+#   as the reference implementation, then prints the time taken by both
+
+import asyncio
+import base64
+import gzip
+import http.server
+import io
+import logging
+import os
+import struct
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+import requests
+from PIL import Image
+from vector2d import Vector2D
+
+import center_of_mass
+import cosmoteer_save_tools
+import part_data
+import part_registry
+from cosmoteer_save_tools import OBNodeType
+import ship_archive
+import ship_batch
+import ship_cache
+import ship_fetch
+import sprite_atlas
+
+SHIP = "ships/Sion.ship.png"
+SYNTHETIC_SIZES = (1024, 2048, 4096)
+LEGACY_MAX_PIXELS = 2048 * 2048  # the reference implementations are too slow above this
+
+
+def timeit(function, *args, repeat=3):
+    """
+    Run a function several times and return its result and the best time.
+
+    Args:
+        function (callable): The function to time.
+        *args: Arguments passed to the function.
+        repeat (int): Number of runs.
+
+    Returns:
+        tuple: The result of the last run and the best time in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def legacy_read_bytes(image_data):
+    """Reference payload extraction, one bit at a time."""
+    def get_byte(offset, data):
+        out_byte = 0
+        for bits_right in range(8):
+            out_byte |= (data[offset * 8 + bits_right] & 1) << bits_right
+        return out_byte
+
+    data = [byte for pixel in image_data for byte in pixel[:3]]
+    length = int.from_bytes(bytes([get_byte(i, data) for i in range(4)]), "big")
+    return bytes([get_byte(i + 4, data) for i in range(length)])
+
+
+def legacy_write_bytes(in_image, in_bytes):
+    """Reference payload embedding, one bit at a time."""
+    def set_byte(offset, byte):
+        for bits_right in range(8):
+            image_offset = offset * 8 + bits_right
+            rgb = image_offset % 3
+            pixel_offset = (offset * 8 + bits_right) // 3
+            mask = (1 << 8) - 2
+            bit = (byte >> bits_right) & 1
+            in_image[pixel_offset][rgb] = (in_image[pixel_offset][rgb] & mask) | bit
+
+    in_bytes = len(in_bytes).to_bytes(4, "big") + in_bytes
+    for offset, byte in enumerate(in_bytes):
+        set_byte(offset, byte)
+    return in_image
+
+
+class LegacyDecoder():
+    """Reference OB decoder, reads one byte at a time from a BytesIO and recurses for every node."""
+    def __init__(self, payload):
+        self.buffer = io.BytesIO(payload)
+
+    def read_varint(self, file):
+        byte = file.read(1)[0]
+        count = 1
+        if byte & 1 != 0:
+            count += 1
+            if byte & 2 != 0:
+                count += 1
+                if byte & 4 != 0:
+                    count += 1
+        for i in range(1, count):
+            byte |= file.read(1)[0] << (i * 8)
+        return byte >> min(count, 3)
+
+    def read_string(self, file):
+        length = 0
+        i = 0
+        while True:
+            byte = file.read(1)[0]
+            length |= (byte & 0x7F) << (i * 7)
+            if byte & 0x80 == 0:
+                break
+            if i > 2:
+                break
+            i += 1
+        return file.read(length).decode('latin1')
+
+    def decode(self):
+        _type = self.buffer.read(1)[0]
+        if _type == OBNodeType.Unset.value:
+            return "Unset"
+        elif _type == OBNodeType.Data.value:
+            size = self.read_varint(self.buffer)
+            return self.buffer.read(size)
+        elif _type == OBNodeType.ChildList.value:
+            count = self.read_varint(self.buffer)
+            return [self.decode() for _ in range(count)]
+        elif _type == OBNodeType.ChildMap.value:
+            count = self.read_varint(self.buffer)
+            d = {}
+            for _ in range(count):
+                key = self.read_string(self.buffer)
+                value = self.decode()
+                if isinstance(value, bytes):
+                    if (
+                        key in ('Rotation', 'Orientation', 'Version', 'FlightDirection', 'FormationOrder', 'Key', 'Max', 'Min', "ID")
+                        and len(value) == 4
+                    ):
+                        value = struct.unpack('<i', value)[0]
+                    elif key == 'DefaultAttackRotation':
+                        value = struct.unpack('<f', value)[0]
+                    elif key == 'DefaultAttackRadius':
+                        value = struct.unpack('<I', value)[0]
+                    elif key == 'Value' and len(value) == 4:
+                        value = struct.unpack('<I', value)[0]
+                    elif key in ('Location', 'Cell', "Key") and len(value) == 8:
+                        value = list(struct.unpack('<ll', value))
+                    elif key in ('FlipX', 'FlipY', "Value") and len(value) == 1:
+                        value = bool(value[0])
+                    elif key in ('ID', 'Name', 'Author', 'RoofBaseTexture', 'ShipRulesID', 'Description', 'ComponentID', 'PartID', 'IDString', "Value"):
+                        value = self.read_string(io.BytesIO(value))
+                    elif key in ('Color', 'RoofBaseColor', 'RoofDecalColor1', 'RoofDecalColor2', 'RoofDecalColor3', 'CrewUniformColor') and len(value) == 16:
+                        value = tuple(value[i:i + 4].hex().upper() for i in range(0, 16, 4))
+                    else:
+                        continue
+                d[key] = value
+            return d
+        elif _type == OBNodeType.Link.value:
+            subtype = self.buffer.read(1)[0]
+            if subtype == 255:
+                return {'_type': 'link', '_id': self.read_varint(self.buffer)}
+            elif subtype == 254:
+                return None
+        if _type == OBNodeType.Null.value:
+            return None
+        raise TypeError(f'Unexpected type {_type}')
+
+
+def legacy_decode(payload):
+    return LegacyDecoder(payload).decode()
+
+
+def count_nodes(node):
+    """Count the nodes of a decoded tree."""
+    if isinstance(node, dict):
+        return 1 + sum(count_nodes(value) for value in node.values())
+    if isinstance(node, list) and not all(isinstance(x, int) for x in node):
+        return 1 + sum(count_nodes(value) for value in node)
+    return 1
+
+
+def embed_payload(pixels, payload):
+    cosmoteer_save_tools.embed_payload(pixels, payload)
+    return pixels
+
+
+def whole_image_read_bytes(image_data):
+    """Reference payload extraction that unpacks every pixel of the image."""
+    bits = np.asarray(image_data)[:, :3].reshape(-1) & 1
+    data = np.packbits(bits.astype(np.uint8), bitorder="little")
+    length = int.from_bytes(data[:4].tobytes(), "big")
+    return data[4:4 + length].tobytes()
+
+
+def synthetic_pixels(size, payload_size, seed=0):
+    """
+    Build a random RGBA image of size x size pixels carrying a random payload.
+
+    Returns:
+        tuple: The (N, 4) pixel array and the embedded payload.
+    """
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (size * size, 4), dtype=np.uint8)
+    payload = rng.integers(0, 256, payload_size, dtype=np.uint8).tobytes()
+    bits = np.unpackbits(np.frombuffer(len(payload).to_bytes(4, "big") + payload, np.uint8), bitorder="little")
+    channels = pixels[:, :3].reshape(-1)
+    channels[:len(bits)] = (channels[:len(bits)] & 0xFE) | bits
+    pixels[:, :3] = channels.reshape(-1, 3)
+    return pixels, payload
+
+
+def synthetic_png(size, payload_size, seed=0):
+    """
+    Encode a synthetic image carrying a random payload as PNG.
+
+    Returns:
+        tuple: The PNG file content and the embedded payload.
+    """
+    pixels, payload = synthetic_pixels(size, payload_size, seed)
+    file = io.BytesIO()
+    Image.fromarray(pixels.reshape(size, size, 4), "RGBA").save(file, "PNG")
+    return file.getvalue(), payload
+
+
+def full_decode_read_bytes(png):
+    """Reference loader, decodes the whole image with PIL before extracting the payload."""
+    pixels = cosmoteer_save_tools.pixel_view(Image.open(io.BytesIO(png)))
+    return cosmoteer_save_tools.extract_payload(pixels)
+
+
+def legacy_pixels(image):
+    """Reference pixel access, a Python sequence of tuples turned into an int64 array."""
+    return np.array(image.getdata())
+
+
+def stream_read_bytes(png):
+    return cosmoteer_save_tools.read_png_payload(io.BytesIO(png))
+
+
+def report(name, legacy_time, new_time, label="legacy"):
+    if legacy_time is None:
+        print(f"{name:<40} {label}: {'skipped':>10}   new: {new_time * 1000:9.2f} ms")
+    else:
+        print(f"{name:<40} {label}: {legacy_time * 1000:8.2f} ms   new: {new_time * 1000:9.2f} ms"
+              f"   speedup: {legacy_time / new_time:7.1f}x")
+
+
+def bench_read_bytes():
+    print("payload extraction (Ship.read_bytes)")
+    cases = [(SHIP, cosmoteer_save_tools.pixel_view(Image.open(SHIP)), None)]
+    for size in SYNTHETIC_SIZES:
+        # large screenshots carry a small ship, the payload stays around the size of a real one
+        pixels, payload = synthetic_pixels(size, 64 * 1024)
+        cases.append((f"synthetic {size}x{size}", pixels, payload))
+
+    for name, pixels, payload in cases:
+        new, new_time = timeit(cosmoteer_save_tools.extract_payload, pixels)
+        legacy_time = None
+        if len(pixels) <= LEGACY_MAX_PIXELS:
+            legacy, legacy_time = timeit(legacy_read_bytes, pixels, repeat=1)
+            assert new == legacy, f"{name}: payload differs from the reference implementation"
+        if payload is not None:
+            assert new == payload, f"{name}: payload differs from the embedded one"
+        report(name, legacy_time, new_time)
+
+
+def bench_early_exit():
+    print("payload extraction, whole image vs header first")
+    for size in SYNTHETIC_SIZES:
+        pixels, payload = synthetic_pixels(size, 64 * 1024)
+        whole, whole_time = timeit(whole_image_read_bytes, pixels)
+        new, new_time = timeit(cosmoteer_save_tools.extract_payload, pixels)
+        assert new == whole == payload, f"{size}x{size}: payload differs from the embedded one"
+        report(f"synthetic {size}x{size}", whole_time, new_time, label="whole")
+
+
+def bench_png_stream():
+    print("PNG loading, full decode vs streaming scanlines")
+    with open(SHIP, "rb") as f:
+        cases = [(SHIP, f.read(), None)]
+    for size in SYNTHETIC_SIZES:
+        png, payload = synthetic_png(size, 64 * 1024)
+        cases.append((f"synthetic {size}x{size}", png, payload))
+
+    for name, png, payload in cases:
+        full, full_time = timeit(full_decode_read_bytes, png, repeat=1)
+        new, new_time = timeit(stream_read_bytes, png)
+        assert new == full, f"{name}: payload differs from the full decode"
+        if payload is not None:
+            assert new == payload, f"{name}: payload differs from the embedded one"
+        report(name, full_time, new_time, label="full")
+
+
+def bench_pixel_access():
+    print("pixel access, image.getdata() vs uint8 view")
+    images = [(SHIP, Image.open(SHIP))]
+    images[0][1].load()
+    for size in SYNTHETIC_SIZES[:2]:
+        pixels, _ = synthetic_pixels(size, 1024)
+        images.append((f"synthetic {size}x{size}", Image.fromarray(pixels.reshape(size, size, 4), "RGBA")))
+
+    for name, image in images:
+        legacy, legacy_time = timeit(legacy_pixels, image, repeat=1)
+        new, new_time = timeit(cosmoteer_save_tools.pixel_view, image)
+        assert (legacy == new).all(), f"{name}: pixels differ"
+        report(name, legacy_time, new_time)
+        print(f"{'':<40} legacy: {legacy.nbytes / 2**20:8.2f} MB   new: {new.nbytes / 2**20:9.2f} MB")
+
+
+def bench_write_bytes():
+    print("payload embedding (Ship.write_bytes)")
+    ship = cosmoteer_save_tools.Ship(SHIP)
+    # re-encode the ship payload like Ship.write does
+    payload = b"COSMOSHIP" + gzip.compress(gzip.decompress(ship.compressed_image_data), 6)
+    cases = [(SHIP, ship.image_data, payload)]
+    for size in SYNTHETIC_SIZES[:2]:
+        pixels, _ = synthetic_pixels(size, 16)
+        payload = np.random.default_rng(1).integers(0, 256, 64 * 1024, dtype=np.uint8).tobytes()
+        cases.append((f"synthetic {size}x{size}", pixels, payload))
+
+    for name, pixels, payload in cases:
+        legacy, legacy_time = timeit(legacy_write_bytes, pixels.astype(np.int64), payload, repeat=1)
+        new, new_time = timeit(embed_payload, pixels.copy(), payload)
+        assert (legacy == new).all(), f"{name}: image differs from the reference implementation"
+        assert cosmoteer_save_tools.extract_payload(new) == payload, f"{name}: payload does not round trip"
+        report(name, legacy_time, new_time)
+
+    # whole Ship.write(), against the reference embedding of the same compressed payload
+    # (gzip stores a timestamp, so the payload is taken back from the written image)
+    new = cosmoteer_save_tools.pixel_view(ship.write())
+    ship_bytes = cosmoteer_save_tools.extract_payload(new)
+    assert gzip.decompress(ship_bytes[9:]) == ship.payload, f"{SHIP}: Ship.write() does not round trip"
+    legacy = legacy_write_bytes(ship.image_data.astype(np.int64), ship_bytes)
+    assert (legacy == new).all(), f"{SHIP}: Ship.write() differs from the reference implementation"
+
+
+def bench_decode():
+    print("OB node decoding (Ship.decode)")
+    ships = [cosmoteer_save_tools.Ship(SHIP), cosmoteer_save_tools.Ship("ships/all.ship.png")]
+    for ship in ships:
+        legacy, legacy_time = timeit(legacy_decode, ship.payload)
+        new, new_time = timeit(ship.decode)
+        # the reference drops binary values it has no conversion for, compare the values it handles
+        assert all(new[key] == legacy[key] for key in ("Parts", "FlightDirection", "Name", "Author")), \
+            f"{ship.image_path}: decoded data differs from the reference implementation"
+        assert bytes(ship.encode(new)) == ship.payload, f"{ship.image_path}: decoded data does not round trip"
+        nodes = count_nodes(new)
+        report(ship.image_path, legacy_time, new_time)
+        print(f"{'':<40} legacy: {nodes / legacy_time / 1e6:5.2f} Mnodes/s   new: {nodes / new_time / 1e6:6.2f} Mnodes/s")
+
+
+def legacy_encode(ship, data_node, byte_data=None):
+    """Reference OB encoder, recurses for every node and builds a temporary object for every value."""
+    if byte_data is None:
+        byte_data = bytearray()
+    if data_node == "Unset":
+        byte_data.append(OBNodeType.Unset.value)
+    elif isinstance(data_node, (str, int, float, bool, tuple, bytes)) or ship.is_2int_list(data_node):
+        byte_data.append(OBNodeType.Data.value)
+        if isinstance(data_node, str):
+            string_data = ship.write_string(data_node)
+            byte_data = ship.write_varint(len(string_data), byte_data)
+            byte_data.extend(string_data)
+            return byte_data
+        elif isinstance(data_node, bool):
+            data = bytearray([data_node])
+        elif isinstance(data_node, int):
+            data = struct.pack("<i" if data_node < 0x80000000 else "<I", data_node)
+        elif isinstance(data_node, float):
+            data = struct.pack("<f", data_node)
+        elif isinstance(data_node, tuple):
+            data = bytearray.fromhex("".join(data_node))
+        elif isinstance(data_node, list):
+            data = struct.pack("<ll", *data_node)
+        else:
+            data = data_node
+        byte_data = ship.write_varint(len(data), byte_data)
+        byte_data.extend(data)
+    elif isinstance(data_node, list):
+        byte_data.append(OBNodeType.ChildList.value)
+        byte_data = ship.write_varint(len(data_node), byte_data)
+        for x in data_node:
+            byte_data = legacy_encode(ship, x, byte_data)
+    elif isinstance(data_node, dict) and data_node.get('_type') == 'link':
+        byte_data.append(OBNodeType.Link.value)
+        byte_data.append(255)
+        byte_data = ship.write_varint(data_node['_id'], byte_data)
+    elif isinstance(data_node, dict):
+        byte_data.append(OBNodeType.ChildMap.value)
+        byte_data = ship.write_varint(len(data_node), byte_data)
+        for key in data_node.keys():
+            byte_data = ship.write_string(key, byte_data)
+            byte_data = legacy_encode(ship, data_node[key], byte_data)
+    elif data_node is None:
+        byte_data.append(OBNodeType.Null.value)
+    else:
+        raise TypeError(f"Unknown datatype: {type(data_node)}")
+    return byte_data
+
+
+def bench_encode():
+    print("OB node encoding (Ship.encode), compared with decoding the same tree")
+    for ship in [cosmoteer_save_tools.Ship(SHIP), cosmoteer_save_tools.Ship("ships/all.ship.png")]:
+        legacy, legacy_time = timeit(legacy_encode, ship, ship.data)
+        new, new_time = timeit(ship.encode, ship.data)
+        _, decode_time = timeit(ship.decode)
+        assert bytes(new) == bytes(legacy) == ship.payload, f"{ship.image_path}: encoding is not byte identical"
+        nodes = count_nodes(ship.data)
+        report(ship.image_path, legacy_time, new_time)
+        print(f"{'':<40} decode: {nodes / decode_time / 1e6:5.2f} Mnodes/s   encode: {nodes / new_time / 1e6:5.2f} Mnodes/s")
+
+
+def bench_projection():
+    print("field projection (Ship.decode(fields=...)), full decode vs projection")
+    projections = [["Parts", "FlightDirection"], cosmoteer_save_tools.METADATA_FIELDS]
+    for ship in [cosmoteer_save_tools.Ship(SHIP), cosmoteer_save_tools.Ship("ships/all.ship.png")]:
+        for fields in projections:
+            full, full_time = timeit(ship.decode)
+            new, new_time = timeit(ship.decode, None, frozenset(fields))
+            assert new == {key: full[key] for key in fields if key in full}, f"{ship.image_path}: projection differs"
+            report(f"{ship.image_path} {'+'.join(fields)}"[:40], full_time, new_time, label="full")
+
+    # skipped subtrees and part tables count against the decode limits like decoded ones
+    nested = {"a": 1}
+    for _ in range(cosmoteer_save_tools.MAX_DEPTH + 1):
+        nested = [nested]
+    deep = memoryview(bytes(ship.encode({"Junk": nested, **full})))
+    expect_error(cosmoteer_save_tools.ShipLimitError, ship.decode, deep, ["Parts"])
+    parts = [dict(full["Parts"][0], Junk=nested)] + full["Parts"][1:]
+    deep = memoryview(bytes(ship.encode({**full, "Parts": parts})))
+    expect_error(cosmoteer_save_tools.ShipLimitError, ship.decode, deep, ["Parts"], True)
+    wide = memoryview(bytes(ship.encode({"Junk": [[0] * 1000] * 3000, **full})))
+    expect_error(cosmoteer_save_tools.ShipLimitError, ship.decode, wide, ["Parts"])
+
+
+def traced_peak(function, *args):
+    """Return the result of a function and the peak memory it allocated, in bytes."""
+    tracemalloc.start()
+    try:
+        result = function(*args)
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_part_table():
+    print("Parts decoding, list of dicts vs PartTable")
+    fields = frozenset(["Parts"])
+    for ship in [cosmoteer_save_tools.Ship(SHIP), cosmoteer_save_tools.Ship("ships/all.ship.png")]:
+        dicts, dicts_time = timeit(ship.decode, None, fields)
+        table, table_time = timeit(ship.decode, None, fields, True)
+        assert table["Parts"].to_list() == dicts["Parts"], f"{ship.image_path}: part table differs"
+        report(ship.image_path, dicts_time, table_time, label="dicts")
+        _, dicts_memory = traced_peak(ship.decode, None, fields)
+        _, table_memory = traced_peak(ship.decode, None, fields, True)
+        print(f"{'':<40} dicts: {dicts_memory / 2**20:9.2f} MB   new: {table_memory / 2**20:9.2f} MB")
+
+
+def bench_cache():
+    print("repeated upload, uncached vs ShipCache hit")
+    for path in [SHIP, "ships/all.ship.png"]:
+        cache = ship_cache.ShipCache()
+        cosmoteer_save_tools.Ship(path, cache=cache)
+        uncached, uncached_time = timeit(cosmoteer_save_tools.Ship, path)
+        cached, cached_time = timeit(lambda: cosmoteer_save_tools.Ship(path, cache=cache))
+        assert cached.data == uncached.data, f"{path}: cached data differs"
+        report(path, uncached_time, cached_time, label="uncached")
+        print(f"{'':<40} {cache.stats()}")
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (3, 1, 1), f"{path}: unexpected cache stats {stats}"
+        cache.clear()
+        stats = cache.stats()
+        assert len(cache) == 0 and stats["entries"] == 0 and stats["bytes"] == 0, f"{path}: clear kept entries"
+        assert stats["hits"] == 3, f"{path}: clear reset the counters"
+    # the disk tier serves a fresh cache, then memory takes over
+    with tempfile.TemporaryDirectory() as directory:
+        ship = cosmoteer_save_tools.Ship(SHIP, cache=ship_cache.ShipCache(directory=directory))
+        cache = ship_cache.ShipCache(directory=directory)
+        for _ in range(2):
+            assert cosmoteer_save_tools.Ship(SHIP, cache=cache).data == ship.data, "disk tier data differs"
+        stats = cache.stats()
+        assert (stats["hits"], stats["disk_hits"], stats["misses"]) == (1, 1, 0), f"unexpected disk tier stats {stats}"
+
+
+def legacy_check_input_type(input_value):
+    # classification before prefix checks: decodes and re-encodes the whole string
+    try:
+        if base64.b64encode(base64.b64decode(input_value)) == input_value.encode():
+            return "base64"
+    except Exception:
+        pass
+    return "file_path"
+
+
+def legacy_ship_from_bytes(data):
+    # what callers holding bytes had to do before Ship accepted them
+    encoded = base64.b64encode(data).decode()
+    legacy_check_input_type(encoded)
+    return cosmoteer_save_tools.Ship(encoded)
+
+
+def bench_input_types():
+    print("bytes input, base64 round trip vs Ship.from_bytes")
+    for path in [SHIP, "ships/all.ship.png"]:
+        with open(path, "rb") as f:
+            data = f.read()
+        legacy, legacy_time = timeit(legacy_ship_from_bytes, data)
+        new, new_time = timeit(cosmoteer_save_tools.Ship.from_bytes, data)
+        assert new.data == legacy.data, f"{path}: from_bytes data differs"
+        report(path, legacy_time, new_time)
+        encoded = base64.b64encode(data).decode()
+        _, legacy_time = timeit(legacy_check_input_type, encoded)
+        _, new_time = timeit(cosmoteer_save_tools.check_input_type, encoded)
+        report("  check_input_type", legacy_time, new_time)
+
+
+FETCH_TEST_LIMIT = 100_000 # max_size of the oversized download checks
+
+
+class ShipRequestHandler(http.server.BaseHTTPRequestHandler):
+    # local stand-in for the Discord CDN, self.server.ship holds the bytes served
+    protocol_version = "HTTP/1.1" # keep-alive, so pooled connections are reused
+
+    def do_GET(self):
+        if self.path == "/ship.png":
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(self.server.ship)))
+            self.end_headers()
+            self.wfile.write(self.server.ship)
+        elif self.path == "/large.png":
+            self.send_response(200)
+            self.send_header("Content-Length", str(FETCH_TEST_LIMIT + 1))
+            self.end_headers()
+            self.wfile.write(bytes(FETCH_TEST_LIMIT + 1))
+        elif self.path == "/chunked.png":
+            # no Content-Length, the limit can only be noticed while streaming
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for _ in range(2 * FETCH_TEST_LIMIT // 10_000):
+                    self.wfile.write(b"%x\r\n%s\r\n" % (10_000, bytes(10_000)))
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True # the client gave up, as it should
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass # aborted downloads and clients closing kept-alive connections
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ShipServer(http.server.ThreadingHTTPServer):
+    # the default backlog of 5 refuses connections when the concurrent downloads all connect at once
+    request_queue_size = 128
+
+
+def expect_error(error, function, *args, **kwargs):
+    try:
+        function(*args, **kwargs)
+    except error:
+        return
+    raise AssertionError(f"{function.__name__}{args} did not raise {error.__name__}")
+
+
+async def expect_error_async(error, coroutine):
+    try:
+        await coroutine
+    except error:
+        return
+    raise AssertionError(f"{coroutine.__name__} did not raise {error.__name__}")
+
+
+async def fetch_all_async(urls):
+    try:
+        return await asyncio.gather(*(ship_fetch.fetch_async(url) for url in urls))
+    finally:
+        await ship_fetch.close_async_session()
+
+
+async def check_fetch_async(base, ship, close):
+    import aiohttp
+    assert await ship_fetch.fetch_async(base + "/ship.png") == ship, "async download differs"
+    await expect_error_async(aiohttp.ClientResponseError, ship_fetch.fetch_async(base + "/missing.png"))
+    await expect_error_async(ship_fetch.DownloadTooLargeError,
+                             ship_fetch.fetch_async(base + "/large.png", FETCH_TEST_LIMIT))
+    await expect_error_async(ship_fetch.DownloadTooLargeError,
+                             ship_fetch.fetch_async(base + "/chunked.png", FETCH_TEST_LIMIT))
+    urls = [base + "/ship.png"] * 16
+    assert await asyncio.gather(*(ship_fetch.fetch_async(url) for url in urls)) == [ship] * 16, \
+        "concurrent async downloads differ"
+    if close:
+        await ship_fetch.close_async_session()
+
+
+def bench_fetch():
+    print("downloading 32 ships from a local server, requests.get vs pooled ship_fetch")
+    with open(SHIP, "rb") as f:
+        ship = f.read()
+    server = ShipServer(("127.0.0.1", 0), ShipRequestHandler)
+    server.daemon_threads = True
+    server.ship = ship
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        assert ship_fetch.fetch(base + "/ship.png") == ship, "download differs"
+        expect_error(requests.HTTPError, ship_fetch.fetch, base + "/missing.png")
+        expect_error(ship_fetch.DownloadTooLargeError, ship_fetch.fetch, base + "/large.png", FETCH_TEST_LIMIT)
+        expect_error(ship_fetch.DownloadTooLargeError, ship_fetch.fetch, base + "/chunked.png", FETCH_TEST_LIMIT)
+        assert cosmoteer_save_tools.Ship(base + "/ship.png").data == cosmoteer_save_tools.Ship(SHIP).data, \
+            "ship decoded from a url differs"
+        # the first loop stops without closing the shared aiohttp session, the second must not reuse it
+        asyncio.run(check_fetch_async(base, ship, close=False))
+        asyncio_logger = logging.getLogger("asyncio")
+        asyncio_logger.disabled = True # aiohttp logs the session it drops as unclosed
+        try:
+            asyncio.run(check_fetch_async(base, ship, close=True))
+        finally:
+            asyncio_logger.disabled = False
+
+        urls = [base + "/ship.png"] * 32
+        legacy, legacy_time = timeit(lambda: [requests.get(url).content for url in urls])
+        new, new_time = timeit(lambda: [ship_fetch.fetch(url) for url in urls])
+        assert legacy == new, "downloads differ"
+        report("fetch", legacy_time, new_time)
+        _, async_time = timeit(lambda: asyncio.run(fetch_all_async(urls)))
+        report("fetch_async, concurrent", legacy_time, async_time)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def bench_batch():
+    workers = os.cpu_count() or 1
+    print(f"batch decoding of 32 ships, 1 process vs {workers} processes")
+    paths = [SHIP, "ships/all.ship.png"] * 16
+    serial, serial_time = timeit(lambda: sorted(r.path for r in ship_batch.decode_many(paths, workers=1)), repeat=1)
+    pooled, pooled_time = timeit(lambda: sorted(r.path for r in ship_batch.decode_many(paths, workers=workers)), repeat=1)
+    assert serial == pooled, "batch decoding lost ships"
+    report("decode_many", serial_time, pooled_time, label="serial")
+    print(f"{'':<40} serial: {len(paths) / serial_time:6.1f} ships/s   new: {len(paths) / pooled_time:6.1f} ships/s")
+
+
+def archive_part_total(path):
+    with ship_archive.ShipArchive(path) as archive:
+        return sum(len(archive.parts(i)) for i in range(len(archive)))
+
+
+def bench_archive():
+    print("loading 32 ships, PNG decoding vs ship archive")
+    paths = [SHIP, "ships/all.ship.png"] * 16
+    options = {"fields": ship_archive.ARCHIVE_FIELDS, "part_table": True}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "corpus.shiparc")
+        ship_archive.write_archive(path, ship_batch.decode_many(paths, workers=1, **options))
+        decoded, decode_time = timeit(lambda: sum(len(r.data["Parts"]) for r in ship_batch.decode_many(paths, workers=1, **options)), repeat=1)
+        loaded, load_time = timeit(archive_part_total, path)
+        assert decoded == loaded, "archive lost parts"
+        report("ship archive", decode_time, load_time, label="decode")
+
+
+def legacy_parts_touching(part1, part2):
+    # reference adjacency test: tile lists and `in` membership tests
+    tiles = []
+    for part in (part1, part2):
+        x, y, width, height = center_of_mass.part_rectangle(part)
+        tiles.append([(x + i, y + j) for i in range(width) for j in range(height)])
+    part1_tiles, part2_tiles = tiles
+    grown = part1_tiles + [(x + dx, y + dy) for x, y in part1_tiles for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1))]
+    return any(tile in part2_tiles for tile in grown)
+
+
+def legacy_boosted_thrusters(parts):
+    return [
+        part["ID"] in part_data.thruster_data
+        and any(other["ID"] == "cosmoteer.engine_room" and legacy_parts_touching(part, other) for other in parts)
+        for part in parts
+    ]
+
+
+def grid_boosted_thrusters(parts):
+    grid = center_of_mass.OccupancyGrid(parts)
+    return (grid.touching_engine_room() & part_registry.IS_THRUSTER[grid.rows]).tolist()
+
+
+def synthetic_ship(blocks, seed=0):
+    """
+    Build a part list of blocks 3x3 tile blocks, each an engine room or nine 1x1 parts,
+    a third of them thrusters.
+    """
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(blocks)))
+    parts = []
+    for block in range(blocks):
+        x, y = block % side * 3, block // side * 3
+        if rng.random() < 0.1:
+            parts.append({"ID": "cosmoteer.engine_room", "Location": [x, y], "Rotation": 0, "FlipX": False})
+            continue
+        for i in range(9):
+            part_id = "cosmoteer.thruster_small" if rng.random() < 1 / 3 else "cosmoteer.armor"
+            parts.append({"ID": part_id, "Location": [x + i % 3, y + i // 3], "Rotation": int(rng.integers(4)), "FlipX": False})
+    return parts
+
+
+def bench_engine_room():
+    print("engine room boost of every thruster, tile lists vs OccupancyGrid")
+    for blocks in (30, 300, 1000):
+        parts = synthetic_ship(blocks)
+        thrusters = sum(part["ID"] in part_data.thruster_data for part in parts)
+        legacy, legacy_time = timeit(legacy_boosted_thrusters, parts, repeat=1)
+        new, new_time = timeit(grid_boosted_thrusters, parts)
+        assert legacy == new, f"{len(parts)} parts: boosted thrusters differ"
+        report(f"{len(parts)} parts, {thrusters} thrusters", legacy_time, new_time)
+    # a few parts far apart, memory must follow the parts and not their bounding box
+    for distance in (5000, 15000, 2 ** 30):
+        parts = [
+            {"ID": "cosmoteer.armor", "Location": [0, 0], "Rotation": 0, "FlipX": False},
+            {"ID": "cosmoteer.engine_room", "Location": [distance, distance], "Rotation": 0, "FlipX": False},
+            {"ID": "cosmoteer.thruster_small", "Location": [distance + 3, distance], "Rotation": 0, "FlipX": False},
+            {"ID": "cosmoteer.thruster_small", "Location": [-distance, 0], "Rotation": 0, "FlipX": False},
+        ]
+        legacy, legacy_time = timeit(legacy_boosted_thrusters, parts)
+        tracemalloc.start()
+        new, new_time = timeit(grid_boosted_thrusters, parts)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert legacy == new == [False, False, True, False], f"parts {distance} tiles apart: boosted thrusters differ"
+        assert peak < 1024 * 1024, f"parts {distance} tiles apart: {peak} bytes allocated"
+        report(f"4 parts {distance} tiles apart, {peak // 1024} KiB", legacy_time, new_time)
+
+
+def legacy_center_of_mass(parts):
+    # reference: one part_center_of_mass call and part_data lookups per part
+    total_mass = 0
+    sum_x_mass = 0
+    sum_y_mass = 0
+    for part in parts:
+        mass = part_data.parts[part["ID"]]["mass"]
+        x_coord, y_coord = center_of_mass.part_center_of_mass(part)
+        total_mass += mass
+        sum_x_mass += mass * x_coord
+        sum_y_mass += mass * y_coord
+    if total_mass == 0:
+        return 0, 0, 0
+    return sum_x_mass / total_mass, sum_y_mass / total_mass, total_mass
+
+
+def random_parts(count, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = [part_id for part_id in part_data.parts]
+    return [
+        {"ID": ids[i], "Location": [int(x), int(y)], "Rotation": int(r), "FlipX": False}
+        for i, x, y, r in zip(rng.integers(len(ids), size=count), rng.integers(-60, 60, count),
+                              rng.integers(-60, 60, count), rng.integers(4, size=count))
+    ]
+
+
+def bench_center_of_mass():
+    print("center of mass, per part loop vs arrays")
+    for count in (10, 100, 1000, 10_000, 50_000):
+        parts = random_parts(count)
+        legacy, legacy_time = timeit(legacy_center_of_mass, parts)
+        new, new_time = timeit(center_of_mass.center_of_mass, parts)
+        table = cosmoteer_save_tools.PartTable.from_list(parts)
+        from_table, table_time = timeit(center_of_mass.center_of_mass, table)
+        assert np.allclose(legacy, new, rtol=1e-9), f"{count} parts: center of mass differs"
+        assert np.allclose(legacy, from_table, rtol=1e-9), f"{count} parts: center of mass of the PartTable differs"
+        report(f"{count} parts", legacy_time, new_time)
+        report(f"{count} parts, PartTable", legacy_time, table_time)
+
+
+def legacy_part_center_of_thrust(part, boost):
+    # reference: rotation if/elif chain, a Vector2D per point, lateral points appended per call
+    part_cots = part_data.thruster_data.get(part["ID"], {"cot": 0})["cot"]
+    thrust = part_data.thruster_data.get(part["ID"], {"thrust": 0})["thrust"]
+    if not boost and part["ID"] == "cosmoteer.thruster_boost":
+        thrust = thrust / 3
+    if part_cots == 0:
+        return 0
+    rotation = part["Rotation"]
+    size = part_data.parts[part["ID"]]["size"]
+    x, y = part["Location"]
+    absolute_cots = []
+    for cot_x, cot_y, cot_orientation in part_cots:
+        if rotation == 0:
+            point = Vector2D(x + cot_x, y + cot_y)
+        elif rotation == 1:
+            point = Vector2D(x - cot_y + size[1], y + cot_x)
+        elif rotation == 2:
+            point = Vector2D(x - cot_x + size[0], y - cot_y + size[1])
+        else:
+            point = Vector2D(x + cot_y, y - cot_x + size[0])
+        absolute_cots.append((point, (rotation + cot_orientation) % 4, thrust))
+    for i in range(len(absolute_cots)):
+        absolute_cots.append((absolute_cots[i][0], (absolute_cots[i][1] + 1) % 4, absolute_cots[i][2] * 0.05))
+        absolute_cots.append((absolute_cots[i][0], (absolute_cots[i][1] + 3) % 4, absolute_cots[i][2] * 0.05))
+    return absolute_cots
+
+
+def legacy_center_of_thrust(parts, boost):
+    # engine rooms are found with the grid so only the per point accumulation is compared
+    boosted = center_of_mass.OccupancyGrid(parts).touching_engine_room()
+    origin_thrust = [Vector2D(0, 0) for _ in range(4)]
+    thrust_direction = [0, 0, 0, 0]
+    for index, part in enumerate(parts):
+        cots = legacy_part_center_of_thrust(part, boost)
+        if cots == 0:
+            continue
+        for origin, orientation, thrust in cots:
+            if boosted[index]:
+                thrust = thrust * 1.5
+            thrust_direction[orientation] += thrust
+            origin_thrust[orientation] += origin * thrust
+    for i in range(4):
+        if thrust_direction[i] != 0:
+            origin_thrust[i] = origin_thrust[i] / thrust_direction[i]
+    return origin_thrust, thrust_direction
+
+
+def bench_center_of_thrust():
+    print("center of thrust, Vector2D accumulation vs compiled thruster tables")
+    for blocks in (30, 300, 3000):
+        parts = synthetic_ship(blocks)
+        for boost in (True, False):
+            (legacy_origin, legacy_thrust), legacy_time = timeit(legacy_center_of_thrust, parts, boost)
+            (origin, _, thrust), new_time = timeit(center_of_mass.center_of_thrust, parts, {"boost": boost})
+            assert np.allclose(legacy_thrust, thrust, rtol=1e-9), f"{len(parts)} parts: thrust differs"
+            assert np.allclose([(v.x, v.y) for v in legacy_origin], [(v.x, v.y) for v in origin], rtol=1e-9), \
+                f"{len(parts)} parts: center of thrust differs"
+        report(f"{len(parts)} parts", legacy_time, new_time)
+
+
+def ship_placements(path):
+    # (part, pixel x, pixel y) of every sprite draw_ship places, at 16 pixels per tile
+    parts, _ = center_of_mass.remove_weird_parts(cosmoteer_save_tools.Ship(path, fields=["Parts"]).data["Parts"])
+    placements = []
+    for part in parts:
+        x, y = center_of_mass.sprite_position(part, [part["Location"][0] + 60, part["Location"][1] + 60])
+        placements.append((part, round(x * 16), round(y * 16)))
+    return placements
+
+
+def legacy_insert_sprite(background, sprite, x, y, rotation, flipx, size):
+    # reference: float64 alpha and a blend per channel
+    sprite = center_of_mass.rotate_image(cv2.resize(sprite, size), rotation, flipx)
+    y_end, x_end, _ = sprite.shape
+    if y + y_end <= background.shape[0] and x + x_end <= background.shape[1]:
+        alpha_channel = sprite[:, :, 3] / 255.0
+        background_region = background[y:y+y_end, x:x+x_end]
+        for c in range(3):
+            background_region[:, :, c] = (
+                (1.0 - alpha_channel) * background_region[:, :, c]
+                + alpha_channel * sprite[:, :, c]
+            )
+    return background
+
+
+def legacy_draw_sprites(placements):
+    # reference: a PNG decode, resize and rotation per part, then the float64 dimming
+    img = np.zeros((120 * 16, 120 * 16, 3), np.uint8)
+    for part, x, y in placements:
+        sprite = cv2.imread("sprites/" + part["ID"].replace("cosmoteer.", "") + ".png", cv2.IMREAD_UNCHANGED)
+        legacy_insert_sprite(img, sprite, x, y, part["Rotation"], part.get("FlipX", 0),
+                             (round(sprite.shape[1] / 4), round(sprite.shape[0] / 4)))
+    return img * 0.8
+
+
+def atlas_draw_sprites(placements, atlas):
+    img = np.zeros((120 * 16, 120 * 16, 3), np.uint8)
+    for part, x, y in placements:
+        sprite_atlas.blit(img, atlas.variant(part["ID"], part["Rotation"], part.get("FlipX", 0), 0.25), x, y)
+    return cv2.LUT(img, center_of_mass.DIM_LUT)
+
+
+def bench_sprites():
+    print("drawing part sprites, float64 file per part vs uint8 sprite atlas")
+    atlas = sprite_atlas.SpriteAtlas()
+    for path in [SHIP, "ships/all.ship.png"]:
+        placements = ship_placements(path)
+        legacy, legacy_time = timeit(legacy_draw_sprites, placements, repeat=1)
+        new, new_time = timeit(atlas_draw_sprites, placements, atlas)
+        # the float blend truncates where the uint8 one rounds, renders are not identical
+        difference = np.abs(np.round(legacy) - new)
+        assert difference.max() <= 2, f"{path}: sprites drawn differently"
+        report(f"{path} ({len(placements)} parts)", legacy_time, new_time)
+        print(f"    canvas {legacy.nbytes // 1024} KiB -> {new.nbytes // 1024} KiB, "
+              f"{np.count_nonzero(difference.max(axis=2))} pixels differ by up to {difference.max():.0f} levels")
+
+
+def draw_with_flags(parts, flags, layer_key):
+    com = list(center_of_mass.center_of_mass(parts))
+    images = []
+    for args in flags:
+        cot = center_of_mass.diagonal_center_of_thrust(*center_of_mass.center_of_thrust(parts, args))
+        # draw_ship moves the top turrets to the end of the list it is given, as com() passes it a fresh one
+        images.append(center_of_mass.draw_ship(list(parts), com, list(cot), 1, "", args, layer_key))
+    return images
+
+
+def bench_render_cache():
+    print("drawing a ship again with other flags, full render vs cached base layer")
+    base = {"boost": True, "draw_com": True, "draw_cot": True}
+    flags = [dict(base, draw_all_cot=all_cot, draw_all_com=all_com, flip_vectors=flip)
+             for all_cot in (True, False) for all_com in (False, True) for flip in (False, True)]
+    for path in [SHIP, "ships/all.ship.png"]:
+        ship = cosmoteer_save_tools.Ship(path, fields=["Parts"])
+        parts, _ = center_of_mass.remove_weird_parts(ship.data["Parts"])
+        layer_key = ship_cache.ShipCache.make_key(ship.compressed_image_data)
+        center_of_mass.RENDER_CACHE.clear()
+        legacy, legacy_time = timeit(draw_with_flags, parts, flags, None, repeat=1)
+        new, new_time = timeit(draw_with_flags, parts, flags, layer_key)
+        assert legacy == new, f"{path}: drawings differ"
+        report(f"{path} ({len(flags)} flag sets)", legacy_time, new_time, label="uncached")
+
+
+def bench_render_scale():
+    print("drawing a ship, full size vs previews at lower scales")
+    args = {"boost": True, "draw_com": True, "draw_cot": True, "draw_all_cot": True, "draw_all_com": False,
+            "flip_vectors": False}
+    for path in [SHIP, "ships/all.ship.png"]:
+        ship = cosmoteer_save_tools.Ship(path, fields=["Parts"])
+        parts, _ = center_of_mass.remove_weird_parts(ship.data["Parts"])
+        layer_key = ship_cache.ShipCache.make_key(ship.compressed_image_data)
+        center_of_mass.RENDER_CACHE.clear()
+        full, full_time = timeit(draw_with_flags, parts, [args], layer_key)
+        full_pixels = cv2.imdecode(np.frombuffer(base64.b64decode(full[0]), np.uint8), cv2.IMREAD_COLOR).size
+        for scale in (0.5, 0.25):
+            preview, preview_time = timeit(draw_with_flags, parts, [dict(args, scale=scale)], layer_key)
+            pixels = cv2.imdecode(np.frombuffer(base64.b64decode(preview[0]), np.uint8), cv2.IMREAD_COLOR).size
+            report(f"{path} scale {scale} ({full_pixels / pixels:.0f}x fewer pixels)", full_time, preview_time,
+                   label="full size")
+
+    # far apart parts are refused before their canvas is allocated, and fit at a smaller scale
+    far = [dict(parts[0], Location=[0, 0]), dict(parts[0], Location=[1010, 1010])]
+    center_of_mass.RENDER_CACHE.clear()
+    (refused,), peak = traced_peak(draw_with_flags, far, [args], None)
+    assert refused == "error drawing ship: too large\n" and peak < 2**20, "far apart parts were drawn at full size"
+    (preview,) = draw_with_flags(far, [dict(args, scale=0.125)], None)
+    assert preview != refused, "far apart parts were not drawn at scale 0.125"
+
+
+if(__name__ == "__main__"):
+    bench_read_bytes()
+    bench_early_exit()
+    bench_png_stream()
+    bench_pixel_access()
+    bench_write_bytes()
+    bench_decode()
+    bench_encode()
+    bench_projection()
+    bench_part_table()
+    bench_cache()
+    bench_input_types()
+    bench_fetch()
+    bench_batch()
+    bench_archive()
+    bench_engine_room()
+    bench_center_of_mass()
+    bench_center_of_thrust()
+    bench_sprites()
+    bench_render_cache()
+    bench_render_scale()
@@ -19,12 +19,18 @@
 #   the center of thrust will be drawn as a green arrow and yellow arrows for each direction
 #   if you can't see the window, the image will be saved as out.png
 
-import part_data
+import part_registry
 import cosmoteer_save_tools
+import render_cache
+import ship_cache
+import sprite_atlas
 from pathlib import Path
 from vector2d import Vector2D
 import base64
+import itertools
 
+SHIP_CACHE=ship_cache.ShipCache() # the bot sees the same ships uploaded again and again
+RENDER_CACHE=render_cache.RenderCache() # and is asked to draw them again with other flags
 BOOST=True
 DRAW_ALL_COM=False
 DRAW_COM=True
@@ -35,9 +41,44 @@ SHIP="ships/Sion.ship.png" #set to the name of your ship.png
 import cv2
 import numpy as np
 
+ENGINE_ROOM_BOOST = 1.5 # thrust multiplier of thrusters touching an engine room
+SHIP_DIMMING = 0.8 # brightness of the ship sprites, so the markers drawn over them stand out
+DIM_LUT = np.round(np.arange(256) * SHIP_DIMMING).astype(np.uint8)
+SPRITE_SQUARE_SIZE = 64 # pixels per tile of the sprite files
+PIXELS_PER_TILE = 16 # pixels per tile of drawings at scale 1
+MAX_CANVAS_PIXELS = 4096 * 4096 # pixels of a drawing, 48 MiB and about 256 by 256 tiles at 16 pixels per tile
+
+def part_arrays(parts):
+    """
+    Gather the parts into arrays.
+
+    Args:
+        parts (list or cosmoteer_save_tools.PartTable): List of parts.
+
+    Returns:
+        tuple: part_registry row, x, y (int64) and rotation (0 to 3) of each part.
+    """
+    if isinstance(parts, cosmoteer_save_tools.PartTable):
+        rows = np.array([part_registry.INDEX[part_id] for part_id in parts.type_names], np.intp)
+        return rows[parts.type_index], parts.x.astype(np.int64), parts.y.astype(np.int64), parts.rotation % 4
+    count = len(parts)
+    rows = np.fromiter((part_registry.INDEX[part["ID"]] for part in parts), np.intp, count)
+    location = np.fromiter(itertools.chain.from_iterable(part["Location"] for part in parts), np.int64, 2 * count)
+    rotation = np.fromiter((part["Rotation"] for part in parts), np.int64, count) % 4
+    return rows, location[0::2], location[1::2], rotation
+
+def part_rectangle(part):
+    """
+    Return the tiles covered by a part as (x, y, width, height), rotation applied.
+    """
+    width, height = part_registry.ROTATED_SIZE[part_registry.INDEX[part["ID"]], part["Rotation"] % 4].tolist()
+    return part["Location"][0], part["Location"][1], width, height
+
 def parts_touching(part1, part2):
     """
     Check if two parts are touching each other.
+
+    Parts touch when they share a tile or an edge, touching only by a corner does not count.
     
     Args:
         part1 (dict): Dictionary containing information about part 1.
@@ -46,45 +87,21 @@ def parts_touching(part1, part2):
     Returns:
         bool: True if part1 and part2 are touching, False otherwise.
     """
-    part1_size = part_data.parts[part1["ID"]]["size"]
-    part2_size = part_data.parts[part2["ID"]]["size"]
-    part1_location = part1["Location"]  # upper left corner
-    part2_location = part2["Location"]  # upper left corner
-    part1_rotation = part1["Rotation"]  # 0, 1, 2, 3
-    part2_rotation = part2["Rotation"]  # 0, 1, 2, 3
-
-    if part1_rotation == 1 or part1_rotation == 3:
-        part1_size = (part1_size[1], part1_size[0])
-    if part2_rotation == 1 or part2_rotation == 3:
-        part2_size = (part2_size[1], part2_size[0])
-
-    # generate list of tiles for each part
-    part1_tiles = []
-    part2_tiles = []
-    for i in range(part1_size[0]):
-        for j in range(part1_size[1]):
-            part1_tiles.append((part1_location[0] + i, part1_location[1] + j))
-    for i in range(part2_size[0]):
-        for j in range(part2_size[1]):
-            part2_tiles.append((part2_location[0] + i, part2_location[1] + j))
-
-    # expand tiles of part 1 to include adjacent tiles (except diagonals)
-    for i in range(part1_size[0]):
-        for j in range(part1_size[1]):
-            part1_tiles.append((part1_location[0] + i + 1, part1_location[1] + j))
-            part1_tiles.append((part1_location[0] + i - 1, part1_location[1] + j))
-            part1_tiles.append((part1_location[0] + i, part1_location[1] + j + 1))
-            part1_tiles.append((part1_location[0] + i, part1_location[1] + j - 1))
-    
-    # check if any of the tiles of part 1 are touching part 2
-    for tile in part1_tiles:
-        if tile in part2_tiles:
-            return True
-    return False
+    x1, y1, w1, h1 = part_rectangle(part1)
+    x2, y2, w2, h2 = part_rectangle(part2)
+
+    # part 1 grown by one tile horizontally or vertically (not diagonally) must overlap part 2
+    overlap_x = x1 < x2 + w2 and x2 < x1 + w1
+    overlap_y = y1 < y2 + h2 and y2 < y1 + h1
+    near_x = x1 - 1 < x2 + w2 and x2 < x1 + w1 + 1
+    near_y = y1 - 1 < y2 + h2 and y2 < y1 + h1 + 1
+    return (near_x and overlap_y) or (overlap_x and near_y)
     
 def thruster_touching_engine_room(parts, thruster):
     """
     Checks if the given thruster is touching the engine room part.
+
+    To check every part of a ship at once use OccupancyGrid(parts).touching_engine_room().
     
     Args:
         parts (list): List of parts to check.
@@ -98,10 +115,89 @@ def thruster_touching_engine_room(parts, thruster):
             return True
     return False
 
+class OccupancyGrid():
+    """
+    Sparse tile map of a ship, built once and shared by adjacency queries.
+
+    Only covered tiles are stored, as sorted integer keys, so memory follows the number of
+    parts and not the size of the ship's bounding box. Keys are built from the rank of a
+    tile's column in columns and of its row in lines, which hold every column and row covered
+    or next to a covered tile. Tiles covered by overlapping parts are stored once per part.
+    """
+    def __init__(self, parts):
+        """
+        Args:
+            parts (list or cosmoteer_save_tools.PartTable): List of parts.
+        """
+        self.rows, self.x, self.y, self.rotation = part_arrays(parts)
+        self.width, self.height = part_registry.ROTATED_SIZE[self.rows, self.rotation].T
+        count = len(self.rows)
+
+        # one entry per covered tile: the part it belongs to and its coordinates
+        areas = self.width * self.height
+        self.tile_part = np.repeat(np.arange(count), areas)
+        offsets = np.arange(len(self.tile_part)) - np.repeat(np.cumsum(areas) - areas, areas)
+        tile_width = self.width[self.tile_part]
+        self.tile_x = self.x[self.tile_part] + offsets % tile_width
+        self.tile_y = self.y[self.tile_part] + offsets // tile_width
+
+        self.columns = np.unique(np.concatenate((self.tile_x - 1, self.tile_x, self.tile_x + 1)))
+        self.lines = np.unique(np.concatenate((self.tile_y - 1, self.tile_y, self.tile_y + 1)))
+        self.tile_keys = self.key(self.tile_x, self.tile_y)
+
+    def key(self, x, y) -> np.ndarray:
+        """
+        Return the keys of tiles, which must be covered or next to a covered tile.
+        """
+        return np.searchsorted(self.lines, y) * len(self.columns) + np.searchsorted(self.columns, x)
+
+    def touching(self, selected) -> np.ndarray:
+        """
+        Find the parts that touch any of the selected parts, as parts_touching does.
+
+        The selected tiles are grown by one tile horizontally and vertically and every
+        part with a tile among them touches, so the cost does not depend on how many parts
+        are selected. A selected part counts as touching itself.
+
+        Args:
+            selected (array-like): Boolean per part.
+
+        Returns:
+            numpy.ndarray: Boolean per part.
+        """
+        covered = np.asarray(selected, bool)[self.tile_part]
+        x = self.tile_x[covered]
+        y = self.tile_y[covered]
+        grown = np.unique(np.concatenate((
+            self.key(x, y), self.key(x - 1, y), self.key(x + 1, y), self.key(x, y - 1), self.key(x, y + 1))))
+        hit = np.isin(self.tile_keys, grown)
+        return np.bincount(self.tile_part, hit, len(self.rows)) > 0
+
+    def touching_engine_room(self) -> np.ndarray:
+        """
+        Return a boolean per part, True when it touches an engine room.
+        """
+        return self.touching(self.rows == part_registry.ENGINE_ROOM)
+
+    def neighbours(self, index) -> np.ndarray:
+        """
+        Return the indices of the parts touching part index, as parts_touching does.
+        Overlapping parts touch.
+        """
+        selected = np.zeros(len(self.rows), bool)
+        selected[index] = True
+        touching = self.touching(selected)
+        touching[index] = False
+        return np.flatnonzero(touching)
+
+
 def center_of_thrust(parts, args):
     """
     Calculate the center of thrust for a given set of parts.
 
+    The thrust points of every part are gathered from the compiled thruster tables and summed
+    per direction with np.bincount.
+
     Args:
         parts (list): List of parts.
         args (dict): Dictionary of arguments.
@@ -109,46 +205,36 @@ def center_of_thrust(parts, args):
     Returns:
         tuple: A tuple containing the origin thrust, thrust vector, and thrust direction.
     """
+    grid = OccupancyGrid(parts)
+    rows, x, y = grid.rows, grid.x, grid.y
+    registry = part_registry
 
-    # Initialize origin thrust for each direction
-    origin_thrust = [
-        Vector2D(0, 0),
-        Vector2D(0, 0),
-        Vector2D(0, 0),
-        Vector2D(0, 0)
-    ]
-
-    # Initialize thrust direction for each direction
-    thrust_direction = [0, 0, 0, 0]
-
-    # Iterate over each part
-    for part in parts:
-        # Calculate the center of thrust for the part
-        cots = part_center_of_thrust(part, args["boost"])
-
-        # Skip if center of thrust is zero
-        if cots == 0:
-            continue
-
-        # Iterate over each center of thrust
-        for cot in cots:
-            origin = cot[0]
-            orientation = cot[1]
-            thrust = cot[2]
+    # one row per thrust point: the part it belongs to and its entry in the tables
+    table_row = rows * 4 + grid.rotation
+    counts = registry.COT_COUNT[table_row]
+    point_part = np.repeat(np.arange(len(rows)), counts)
+    point = np.repeat(registry.COT_START[table_row] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
 
-            # Increase thrust if thruster is touching engine room
-            if thruster_touching_engine_room(parts, part):
-                thrust = thrust * 1.5
+    thrust = registry.COT_THRUST[point]
+    if not args["boost"]:
+        thrust = np.where(rows[point_part] == registry.THRUSTER_BOOST, thrust / 3, thrust)
+    # Increase thrust of the thrusters touching an engine room, found once for the whole ship
+    boosted = grid.touching_engine_room()
+    thrust = np.where(boosted[point_part], thrust * ENGINE_ROOM_BOOST, thrust)
 
-            # Update thrust direction and origin thrust for the given orientation
-            thrust_direction[orientation] += thrust
-            origin_thrust[orientation] += origin * thrust
+    orientation = registry.COT_ORIENTATION[point]
+    thrust_direction = np.bincount(orientation, thrust, 4)
+    sum_x = np.bincount(orientation, thrust * (x[point_part] + registry.COT_X[point]), 4)
+    sum_y = np.bincount(orientation, thrust * (y[point_part] + registry.COT_Y[point]), 4)
 
     # Calculate the average origin thrust for each direction
-    for i in range(len(thrust_direction)):
+    origin_thrust = []
+    for i in range(4):
         if thrust_direction[i] == 0:
-            continue
-        origin_thrust[i] = origin_thrust[i] / thrust_direction[i]
+            origin_thrust.append(Vector2D(0, 0))
+        else:
+            origin_thrust.append(Vector2D(sum_x[i] / thrust_direction[i], sum_y[i] / thrust_direction[i]))
+    thrust_direction = thrust_direction.tolist()
 
     # Calculate the end of the thrust vector
     thrust_vector = [
@@ -243,21 +329,11 @@ def part_center_of_mass(part):
     Returns:
         tuple: The x and y coordinates of the center of mass.
     """
-    # Get part size
-    part_size = part_data.parts[part["ID"]]["size"]
-    part_rotation = part["Rotation"] # 0, 1, 2, 3
+    # Get part size once rotated
+    width, height = part_registry.ROTATED_SIZE[part_registry.INDEX[part["ID"]], part["Rotation"] % 4].tolist()
 
     # Calculate center of mass
-    if part_rotation == 0 or part_rotation == 2:
-        center_of_mass_x = part["Location"][0] + part_size[0] / 2
-        center_of_mass_y = part["Location"][1] + part_size[1] / 2
-    elif part_rotation == 1 or part_rotation == 3:
-        center_of_mass_x = part["Location"][0] + part_size[1] / 2
-        center_of_mass_y = part["Location"][1] + part_size[0] / 2
-    else:
-        print("ERROR: part_rotation not 0, 1, 2, 3")
-
-    return center_of_mass_x, center_of_mass_y
+    return part["Location"][0] + width / 2, part["Location"][1] + height / 2
 
 def part_center_of_thrust(part, boost):
     """
@@ -270,84 +346,56 @@ def part_center_of_thrust(part, boost):
     Returns:
         list: A list of tuples representing the multiple centers of thrust for the part.
     """
-    # Get part center of thrust (cot) and thrust values
-    part_cots = part_data.thruster_data.get(part["ID"], {"cot": 0})["cot"]
-    thrust = part_data.thruster_data.get(part["ID"], {"thrust": 0})["thrust"]
-    
-    # Adjust thrust if part is not boosted and is a specific type
-    if not boost and part["ID"] == "cosmoteer.thruster_boost":
-        thrust = thrust / 3
-    
+    registry = part_registry
+    row = registry.INDEX[part["ID"]]
+    table_row = row * 4 + part["Rotation"] % 4
+
     # Return 0 if part does not have a center of thrust
-    if part_cots == 0:
+    if registry.COT_COUNT[table_row] == 0:
         return 0
-    
-    # Calculate the absolute centers of thrust for the part
-    part_rotation = part["Rotation"]
-    part_size = part_data.parts[part["ID"]]["size"]
-    absolute_cots = []
-    
-    for part_cot in part_cots:
-        # Calculate orientation
-        orientation = (part_rotation + part_cot[2]) % 4
-        
-        # Calculate center of thrust based on part rotation
-        if part_rotation == 0:
-            center_of_thrust_x = part["Location"][0] + part_cot[0]
-            center_of_thrust_y = part["Location"][1] + part_cot[1]
-        elif part_rotation == 1:
-            center_of_thrust_x = part["Location"][0] - part_cot[1] + part_size[1]
-            center_of_thrust_y = part["Location"][1] + part_cot[0]
-        elif part_rotation == 2:
-            center_of_thrust_x = part["Location"][0] - part_cot[0] + part_size[0]
-            center_of_thrust_y = part["Location"][1] - part_cot[1] + part_size[1]
-        elif part_rotation == 3:
-            center_of_thrust_x = part["Location"][0] + part_cot[1]
-            center_of_thrust_y = part["Location"][1] - part_cot[0] + part_size[0]
-        else:
-            print("ERROR: part_rotation not 0, 1, 2, 3")
-        
-        absolute_cots.append((Vector2D(center_of_thrust_x, center_of_thrust_y), orientation, thrust))
-    
-    # Add additional cot tuples with reduced thrust
-    for i in range(len(absolute_cots)):
-        absolute_cots.append((absolute_cots[i][0], (absolute_cots[i][1] + 1) % 4, absolute_cots[i][2] * 0.05))
-        absolute_cots.append((absolute_cots[i][0], (absolute_cots[i][1] + 3) % 4, absolute_cots[i][2] * 0.05))
-    
-    return absolute_cots
+
+    # Adjust thrust if part is not boosted and is a specific type
+    divisor = 3 if not boost and row == registry.THRUSTER_BOOST else 1
+
+    # Look the rotated centers of thrust up, lateral ones included
+    start = registry.COT_START[table_row]
+    points = slice(start, start + registry.COT_COUNT[table_row])
+    location = part["Location"]
+    return [
+        (Vector2D(location[0] + x, location[1] + y), orientation, thrust / divisor)
+        for x, y, orientation, thrust in zip(
+            registry.COT_X[points].tolist(), registry.COT_Y[points].tolist(),
+            registry.COT_ORIENTATION[points].tolist(), registry.COT_THRUST[points].tolist())
+    ]
 
 def center_of_mass(parts):
     """
     Calculate the center of mass for a given list of parts.
 
+    Part IDs are mapped to part_registry rows once, then the centers of all parts are
+    computed and weighted at the same time with NumPy.
+
     Args:
-        parts (list): List of parts.
+        parts (list or cosmoteer_save_tools.PartTable): List of parts.
 
     Returns:
         tuple: Center of mass coordinates (x, y) and total mass.
 
     """
+    if len(parts) == 0:
+        return 0, 0, 0
 
-    total_mass = 0
-    sum_x_mass = 0
-    sum_y_mass = 0
-
-    for part in parts:
-        mass = part_data.parts[part["ID"]]["mass"]
-        x_coord, y_coord = part_center_of_mass(part)
+    rows, x, y, rotation = part_arrays(parts)
+    mass = part_registry.MASS[rows]
+    width, height = part_registry.ROTATED_SIZE[rows, rotation].T
 
-        total_mass += mass
-        sum_x_mass += mass * x_coord
-        sum_y_mass += mass * y_coord
+    center_x = x + width / 2
+    center_y = y + height / 2
 
+    total_mass = float(mass.sum())
     if total_mass == 0:
-        center_of_mass_x = 0
-        center_of_mass_y = 0
-    else:
-        center_of_mass_x = sum_x_mass / total_mass
-        center_of_mass_y = sum_y_mass / total_mass
-
-    return center_of_mass_x, center_of_mass_y, total_mass
+        return 0, 0, total_mass
+    return float(np.dot(mass, center_x)) / total_mass, float(np.dot(mass, center_y)) / total_mass, total_mass
 
 def center_of_thrust_vector(parts, ship_direction):
     """
@@ -383,13 +431,14 @@ def center_of_thrust_vector(parts, ship_direction):
     sum_x_thrust = 0
     sum_y_thrust = 0
 
-    for part in parts:
+    boosted = OccupancyGrid(parts).touching_engine_room()
+    for index, part in enumerate(parts):
         cots = part_center_of_thrust(part)
         if cots == 0:
             continue
         for cot in cots:
-            thrust = part_data.thruster_data[part["ID"]]["thrust"]
-            if thruster_touching_engine_room(parts, part):
+            thrust = part_registry.THRUST[part_registry.INDEX[part["ID"]]]
+            if boosted[index]:
                 thrust *= 1.5
             x_coord = cot[0]
             y_coord = cot[1]
@@ -445,55 +494,12 @@ def rotate_image(image, angle, flipx):
     else:
         return image
 
-def insert_sprite(background, sprite, x, y, rotation, flipx, size):
-    """
-    Inserts a sprite onto a background image at the specified position.
-
-    Args:
-        background (numpy.ndarray): The background image.
-        sprite (numpy.ndarray): The sprite image.
-        x (int): The x-coordinate of the top-left corner of the sprite.
-        y (int): The y-coordinate of the top-left corner of the sprite.
-        rotation (float): The rotation angle of the sprite.
-        flipx (bool): Whether to flip the sprite horizontally.
-        size (tuple): The desired size of the sprite after resizing.
-
-    Returns:
-        numpy.ndarray: The background image with the sprite inserted, or the original background image if the sprite doesn't fit.
-    """
-    sprite = cv2.resize(sprite, size)  # Resize the sprite
-
-    sprite = rotate_image(sprite, rotation, flipx)  # Rotate the sprite
-
-    y_end, x_end, _ = sprite.shape  # Get the dimensions of the sprite
-
-    # Ensure that the sprite fits within the specified region
-    if y + y_end <= background.shape[0] and x + x_end <= background.shape[1]:
-        # Extract the RGB channels from the sprite
-        sprite_rgb = sprite[:, :, :3]
-
-        # Extract the alpha channel from the sprite (opacity)
-        alpha_channel = sprite[:, :, 3] / 255.0  # Normalize to range [0, 1]
-
-        # Extract the corresponding region from the background
-        background_region = background[y:y+y_end, x:x+x_end]
-
-        # Blend the sprite with the background using alpha compositing
-        for c in range(3):  # Iterate over RGB channels
-            background_region[:, :, c] = (
-                (1.0 - alpha_channel) * background_region[:, :, c]
-                + alpha_channel * sprite_rgb[:, :, c]
-            )
-
-    else:
-        # Handle cases where the sprite doesn't fit within the region
-        print(f"Warning: Sprite at ({x}, {y}) exceeds the background dimensions.")
-    
-    return background
-
 def sprite_position(part, position):
     """
     Calculate the offset needed to draw a sprite at a given position.
+
+    Turrets and thrusters have sprites larger than their tiles, part_registry.SPRITE_OFFSET
+    holds how far each of them is shifted for each rotation.
     
     Args:
         part (dict): The part object containing information about the sprite.
@@ -502,121 +508,31 @@ def sprite_position(part, position):
     Returns:
         list: The updated position of the sprite.
     """
-    # Get the sprite size from the part data
-    sprite_size = part_data.parts[part["ID"]].get("sprite_size")
-    
-    if sprite_size is None:
-        return position
-    
-    # Get the part size and rotation
-    part_size = part_data.parts[part["ID"]]["size"]
-    part_rotation = part["Rotation"]
-    
-    # Define problematic parts for each rotation
-    up_turret_parts = [
-        "cosmoteer.laser_blaster_small",
-        "cosmoteer.laser_blaster_large",
-        "cosmoteer.disruptor",
-        "cosmoteer.ion_beam_emitter",
-        "cosmoteer.ion_beam_prism",
-        "cosmoteer.point_defense",
-        "cosmoteer.cannon_med",
-        "cosmoteer.cannon_large",
-        "cosmoteer.cannon_deck",
-        "cosmoteer.missile_launcher",
-        "cosmoteer.railgun_launcher",
-        "cosmoteer.flak_cannon_large",
-        "cosmoteer.shield_gen_small"
-    ]
-    
-    down_turret_parts = [
-        "cosmoteer.thruster_small",
-        "cosmoteer.thruster_med",
-        "cosmoteer.thruster_large",
-        "cosmoteer.thruster_huge",
-        "cosmoteer.thruster_boost"
-    ]
-    
-    multiple_turrets = [
-        "cosmoteer.thruster_small_2way",
-        "cosmoteer.thruster_small_3way"
-    ]
-    
-    # Update position based on part rotation and type
-    if part_rotation == 0 and part["ID"] in up_turret_parts:
-        position[1] -= sprite_size[1] - part_size[1]
-    elif part_rotation == 3 and part["ID"] in up_turret_parts:
-        position[0] -= sprite_size[1] - part_size[1]
-    elif part_rotation == 1 and part["ID"] in down_turret_parts:
-        position[0] -= sprite_size[1] - part_size[1]
-    elif part_rotation == 2 and part["ID"] in down_turret_parts:
-        position[1] -= sprite_size[1] - part_size[1]
-    elif part["ID"] in multiple_turrets:
-        if part["ID"] == "cosmoteer.thruster_small_2way":
-            if part_rotation == 1:
-                position[0] -= 1
-            if part_rotation == 2:
-                position[0] -= 1
-                position[1] -= 1
-            if part_rotation == 3:
-                position[1] -= 1
-        if part["ID"] == "cosmoteer.thruster_small_3way":
-            if part_rotation == 0:
-                position[0] -= 1
-            if part_rotation == 1:
-                position[0] -= 1
-                position[1] -= 1
-            if part_rotation == 2:
-                position[0] -= 1
-                position[1] -= 1
-            if part_rotation == 3:
-                position[1] -= 1
-    
+    offset_x, offset_y = part_registry.SPRITE_OFFSET[part_registry.INDEX[part["ID"]], part["Rotation"] % 4].tolist()
+    if offset_x:
+        position[0] += offset_x
+    if offset_y:
+        position[1] += offset_y
     return position
 
-def crop(image, margin=10):
+def canvas_bounds(boxes, margin=10):
     """
-    Crop the given image based on the non-zero pixel values.
-    The image is a square with the ship in the center.
+    Compute the square canvas holding every box, centered on them and with a margin around.
 
     Args:
-        image (numpy.ndarray): The input image.
-        margin (int): The margin to add or subtract from the min/max values.
+        boxes (numpy.ndarray): (n, 4) array of left, top, right and bottom pixel coordinates
+            of what will be drawn.
+        margin (int): Empty pixels kept around the boxes.
 
     Returns:
-        numpy.ndarray: The cropped image.
+        tuple: left and top pixel coordinates of the canvas, and the length of its side.
     """
-    # Get the non-zero pixel indices
-    y_nonzero, x_nonzero, _ = np.nonzero(image)
-
-    # Calculate the min/max values for x and y
-    xmin = np.min(x_nonzero) - margin
-    xmax = np.max(x_nonzero) + margin
-    ymin = np.min(y_nonzero) - margin
-    ymax = np.max(y_nonzero) + margin
-
-    # Make sure the image is a square
-    if xmax - xmin > ymax - ymin:
-        margin=round((xmax-xmin)/2)-round((ymax-ymin)/2)
-        ymax += margin
-        ymin -= margin
-    elif ymax - ymin > xmax - xmin:
-        margin=round((ymax-ymin)/2)-round((xmax-xmin)/2)
-        xmax += margin
-        xmin -= margin
-
-    # Adjust the min/max values if they exceed the image boundaries
-    if xmin < 0:
-        xmin = 0
-    if xmax > image.shape[1]:
-        xmax = image.shape[1]
-    if ymin < 0:
-        ymin = 0
-    if ymax > image.shape[0]:
-        ymax = image.shape[0]
-
-    # Crop the image based on the calculated min/max values
-    return image[ymin:ymax, xmin:xmax]
+    xmin, ymin = boxes[:, :2].min(axis=0).tolist()
+    xmax, ymax = boxes[:, 2:].max(axis=0).tolist()
+    size = max(xmax - xmin, ymax - ymin) + 2 * margin
+    left = xmin - margin - (size - 2 * margin - (xmax - xmin)) // 2
+    top = ymin - margin - (size - 2 * margin - (ymax - ymin)) // 2
+    return left, top, size
 
 
 
@@ -680,9 +596,56 @@ def draw_legend(output_filename):
     cv2.imwrite(output_filename, img)
 
 
-def draw_ship(parts, data_com, data_cot, ship_orientation, output_filename, args):
+def draw_base_layer(parts, size_factor):
+    """
+    Draw the dimmed sprites of a ship, the part of its drawing the flags do not change.
+
+    Args:
+        parts (list): The ship parts, reordered so top turrets are drawn last.
+        size_factor (int): Pixels per tile.
+
+    Raises:
+        ValueError: If the sprites cover more than MAX_CANVAS_PIXELS, checked before drawing them.
+
+    Returns:
+        render_cache.Layer: The sprites, cropped to their bounding box.
+    """
+    # sprites are drawn from the preloaded atlas, scaled from SPRITE_SQUARE_SIZE to size_factor pixels per tile
+    atlas = sprite_atlas.default_atlas()
+    sprite_scale = size_factor / SPRITE_SQUARE_SIZE
+    # Rearrange parts to draw top turrets last
+    for i in range(len(parts)):
+        if parts[i]["ID"] in ["cosmoteer.cannon_deck", "cosmoteer.ion_beam_prism"]:
+            parts.append(parts.pop(i))
+    # Place the ship parts, in pixels from the ship origin
+    sprites = []
+    for part in parts:
+        rotation = part["Rotation"]
+        flipx = part.get("FlipX", 0)
+        x_coord, y_coord = sprite_position(part, list(part["Location"]))
+        variant = atlas.variant(part["ID"], rotation, flipx, sprite_scale)
+        sprites.append((variant, round(x_coord * size_factor), round(y_coord * size_factor)))
+    if not sprites:
+        return render_cache.Layer(np.zeros((0, 0, 3), np.uint8), 0, 0)
+    boxes = np.array([(x, y, x + variant[1].shape[1], y + variant[1].shape[0]) for variant, x, y in sprites], np.int64)
+    left, top = boxes[:, :2].min(axis=0).tolist()
+    right, bottom = boxes[:, 2:].max(axis=0).tolist()
+    if (right - left) * (bottom - top) > MAX_CANVAS_PIXELS:
+        raise ValueError("ship too large to draw")
+    # Draw ship parts
+    img = np.zeros((bottom - top, right - left, 3), np.uint8)
+    for variant, x_pixel, y_pixel in sprites:
+        sprite_atlas.blit(img, variant, x_pixel - left, y_pixel - top)
+    # Darken the image, in place and without leaving uint8
+    cv2.LUT(img, DIM_LUT, dst=img)
+    return render_cache.Layer(img, left, top)
+
+def draw_ship(parts, data_com, data_cot, ship_orientation, output_filename, args, layer_key=None):
     """
     Draw a ship using OpenCV.
+
+    The sprites are drawn once per ship and scale into a base layer kept in RENDER_CACHE,
+    drawing the same ship with other flags only redraws the markers over a copy of it.
     Args:
     - parts: a list of ship parts
     - data_com: the center of mass data
@@ -690,46 +653,42 @@ def draw_ship(parts, data_com, data_cot, ship_orientation, output_filename, args
     - ship_orientation: the orientation of the ship
     - output_filename: the filename to save the image
     - args: additional arguments
+    - layer_key: identifies the ship in RENDER_CACHE, typically the hash of its payload,
+      no caching when None
+    args["scale"] sizes the drawing, 1 (the default) is PIXELS_PER_TILE pixels per tile,
+    0.5 and 0.25 draw previews of a quarter and a sixteenth of the pixels. Sprites, markers
+    and the canvas follow it. Canvases over MAX_CANVAS_PIXELS are refused before allocating
+    them, a smaller scale draws larger ships.
     Returns:
     - an empty string if the image was successfully saved
     """
-    # Define constants
-    sprite_square_size = 64
-    size_factor = round(sprite_square_size / 4)
-    square_size = round(size_factor)
-    # Create a blank image
-    img = np.zeros((120 * size_factor, 120 * size_factor, 3), np.uint8)
-    # Rearrange parts to draw top turrets last
-    for i in range(len(parts)):
-        if parts[i]["ID"] in ["cosmoteer.cannon_deck", "cosmoteer.ion_beam_prism"]:
-            parts.append(parts.pop(i))
-    # Draw ship parts
-    for part in parts:
-        x_coord = part["Location"][0] + 60
-        y_coord = part["Location"][1] + 60
-        # Check if part is out of bounds
-        if x_coord < 0 or x_coord > 120 or y_coord < 0 or y_coord > 120:
-            return "error drawing ship: out of bounds\n"
-        size = part_data.parts[part["ID"]]["size"]
-        rotation = part["Rotation"]
-        flipx = part.get("FlipX", 0)
-        x_coord, y_coord = sprite_position(part, [x_coord, y_coord])
-        sprite_path = "sprites/" + part["ID"].replace("cosmoteer.", "") + ".png"
-        img_part = cv2.imread(sprite_path, cv2.IMREAD_UNCHANGED)
-        insert_sprite(img, img_part, round(x_coord * size_factor), round(y_coord * size_factor), rotation, flipx,
-                      (round(img_part.shape[1] / 4), round(img_part.shape[0] / 4)))
-    # Darken the image
-    img = img * 0.8
+    # Define constants, sizes in pixels follow the scale of the drawing
+    size_factor = max(1, round(PIXELS_PER_TILE * args.get("scale", 1)))
+    square_size = size_factor
+    line_width = max(1, round(2 * size_factor / PIXELS_PER_TILE))
+    dot_size = max(1, round(3 * size_factor / PIXELS_PER_TILE))
+    def to_pixel(x, y):
+        return round(x * size_factor), round(y * size_factor)
+    layer = None
+    if layer_key is not None:
+        layer = RENDER_CACHE.get((layer_key, size_factor))
+    if layer is None:
+        try:
+            layer = draw_base_layer(parts, size_factor)
+        except ValueError:
+            return "error drawing ship: too large\n"
+        if layer_key is not None:
+            RENDER_CACHE.put((layer_key, size_factor), layer)
+    # Markers drawn over the ship: (cv2 function, points, other arguments, pixels drawn around the points)
+    markers = []
     if args["draw_com"]:
         # Add center of mass
-        cv2.circle(img, (round((data_com[0] + 60) * size_factor), round((data_com[1] + 60) * size_factor)), square_size,
-                   [0, 255, 0], -1)
+        markers.append((cv2.circle, [to_pixel(data_com[0], data_com[1])], (square_size, [0, 255, 0], -1), square_size))
         if args["draw_all_com"]:
             # Add center of mass of each part
             for part in parts:
                 x_coord, y_coord = part_center_of_mass(part)
-                cv2.circle(img, (round((x_coord + 60) * size_factor), round((y_coord + 60) * size_factor)), 1,
-                           [0, 255, 0], -1)
+                markers.append((cv2.circle, [to_pixel(x_coord, y_coord)], (1, [0, 255, 0], -1), 1))
     if args["draw_all_cot"]:
         # Add center of thrust of each part
         for part in parts:
@@ -752,10 +711,11 @@ def draw_ship(parts, data_com, data_cot, ship_orientation, output_filename, args
                 #flip the direction of the arrow
                 if(args["flip_vectors"]):
                     end_point = (vector.x * 2 - end_point[0], vector.y * 2 - end_point[1])
+                start = to_pixel(vector.x, vector.y)
                 # Draw a line
-                cv2.arrowedLine(img, (round((vector.x+60)*size_factor), round((vector.y+60)*size_factor)), (round((end_point[0]+60)*size_factor), round((end_point[1]+60)*size_factor)), [0,0,255], 2, tipLength=0.3)
+                markers.append((cv2.arrowedLine, [start, to_pixel(*end_point)], ([0,0,255], line_width, cv2.LINE_8, 0, 0.3), line_width))
                 # Also draw a dot at the start of the arrow
-                cv2.circle(img, (round((vector.x+60)*size_factor), round((vector.y+60)*size_factor)), 3, [0,0,255], -1)
+                markers.append((cv2.circle, [start], (dot_size, [0,0,255], -1), dot_size))
     
     # Draw center of thrust of the ship
     if args["draw_cot"]:
@@ -770,8 +730,7 @@ def draw_ship(parts, data_com, data_cot, ship_orientation, output_filename, args
         for i in range(8):
             if not args["draw_all_cot"] and i != 7:
                 continue            
-            start = (origin_thrust[i] + 60) * size_factor
-            start = (round(start.x), round(start.y))
+            start = to_pixel(origin_thrust[i].x, origin_thrust[i].y)
             if thrust_direction[i] == 0:
                 continue
             thrust = (thrust_vector[i] - origin_thrust[i]) / total_thrust
@@ -779,23 +738,34 @@ def draw_ship(parts, data_com, data_cot, ship_orientation, output_filename, args
             if(args["flip_vectors"]):
                 thrust = thrust * -1
             end = thrust * size_of_arrow + origin_thrust[i]
-            end = (end + 60) * size_factor
-            end = (round(end.x), round(end.y))
+            end = to_pixel(end.x, end.y)
             if i == 7:
                 arrow_color = [0, 200, 0]
             else:
                 arrow_color = [0, 255, 255]
             # draw a line
-            cv2.arrowedLine(img, start, end, arrow_color, 2, tipLength=0.2)
+            markers.append((cv2.arrowedLine, [start, end], (arrow_color, line_width, cv2.LINE_8, 0, 0.2), line_width))
             # draw a dot
-            cv2.circle(img, start, 3, arrow_color, -1)
+            markers.append((cv2.circle, [start], (dot_size, arrow_color, -1), dot_size))
 
         origin_thrust.insert(ship_orientation, origin_thrust.pop())
         thrust_vector.insert(ship_orientation, thrust_vector.pop())
         thrust_direction.insert(ship_orientation, thrust_direction.pop())
 
-    # Crop the image
-    img = crop(img)
+    # Size the canvas from what is drawn instead of scanning the image for it afterwards
+    height, width = layer.image.shape[:2]
+    boxes = [(layer.left, layer.top, layer.left + width, layer.top + height)]
+    for _, points, _, pad in markers:
+        boxes.extend((x - pad, y - pad, x + pad + 1, y + pad + 1) for x, y in points)
+    left, top, canvas_size = canvas_bounds(np.array(boxes, np.int64), max(1, round(10 * size_factor / PIXELS_PER_TILE)))
+    if canvas_size * canvas_size > MAX_CANVAS_PIXELS:
+        return "error drawing ship: too large\n"
+    # Copy the base layer onto a blank image and draw the markers over it
+    img = np.zeros((canvas_size, canvas_size, 3), np.uint8)
+    img[layer.top - top:layer.top - top + height, layer.left - left:layer.left - left + width] = layer.image
+    for function, points, arguments, _ in markers:
+        function(img, *[(x - left, y - top) for x, y in points], *arguments)
+
     # Save the image
     if output_filename != "":
         cv2.imwrite(output_filename, img)
@@ -814,83 +784,41 @@ def remove_weird_parts(parts):
     Removes parts from the given list that are not present in the part_data.
     Replaces certain old part IDs with their corresponding new part IDs.
     Returns the updated list of parts and any error messages encountered.
-    """
-    # Set to store unknown part IDs
-    unknown_parts = set()
-
-    # Boolean flag to indicate if classic ships are present
-    classic = False
-
-    # List to store the updated parts
-    new_parts = []
-
-    # Iterate over each part in the given list
-    for part in parts:
-        # Check if the part ID is present in part_data
-        if part["ID"] in part_data.parts:
-            new_parts.append(part)
-        else:
-            # List of old part IDs and their corresponding new part IDs
-            old_part_ids = [
-                "cosmoteer.ammo_factory",
-                "cosmoteer.missile_factory_nuke",
-                "cosmoteer.missile_factory_he",
-                "cosmoteer.electro_bolter"
-            ]
-            new_part_ids = [
-                "cosmoteer.factory_ammo",
-                "cosmoteer.factory_nuke",
-                "cosmoteer.factory_he",
-                "cosmoteer.disruptor"
-            ]
-
-            if part["ID"] in old_part_ids:
-                # Replace the part ID with its corresponding new ID
-                part["ID"] = new_part_ids[old_part_ids.index(part["ID"])]
-                print(part)
-                new_parts.append(part)
-                classic = True
-                continue
-
-            # List of old mirror L IDs and their corresponding updated IDs
-            old_mirror_L = [
-                "cosmoteer.structure_1x2_wedge_L",
-                "cosmoteer.structure_1x3_wedge_L",
-                "cosmoteer.armor_1x2_wedge_L",
-                "cosmoteer.armor_1x3_wedge_L"
-            ]
-
-            # List of old mirror R IDs and their corresponding updated IDs
-            old_mirror_R = [
-                "cosmoteer.structure_1x2_wedge_R",
-                "cosmoteer.structure_1x3_wedge_R",
-                "cosmoteer.armor_1x2_wedge_R",
-                "cosmoteer.armor_1x3_wedge_R"
-            ]
-
-            # Check if the part ID is in the old_mirror_L list
-            if part["ID"] in old_mirror_L:
-                # Update the part ID and FlipX value
-                part["ID"] = part["ID"][:-2]
-                part["FlipX"] = 0
-                new_parts.append(part)
-                classic = True
-                continue
-
-            # Check if the part ID is in the old_mirror_R list
-            if part["ID"] in old_mirror_R:
-                # Update the part ID and FlipX value
-                part["ID"] = part["ID"][:-2]
-                part["FlipX"] = 1
-                new_parts.append(part)
-                classic = True
-                continue
-
-            # Add the unknown part ID to the set
-            unknown_parts.add(part["ID"])
 
-            # Update the part ID to "cosmoteer.UNKNOWN"
-            part["ID"] = "cosmoteer.UNKNOWN"
+    The distinct IDs are resolved once through part_registry, a PartTable is remapped
+    without touching its parts one by one.
+    """
+    if isinstance(parts, cosmoteer_save_tools.PartTable):
+        rows, flips, legacy, unknown_parts = part_registry.resolve(parts.type_names)
+        classic = bool(legacy.any())
+        # the table only references the current IDs, legacy ones are merged into them
+        used_rows, type_remap = np.unique(rows, return_inverse=True)
+        forced_flip = flips[parts.type_index]
+        new_parts = cosmoteer_save_tools.PartTable(
+            [part_registry.IDS[row] for row in used_rows.tolist()],
+            type_remap.astype(np.uint16)[parts.type_index],
+            parts.x,
+            parts.y,
+            parts.rotation,
+            np.where(forced_flip >= 0, forced_flip == 1, parts.flip_x),
+        )
+    else:
+        unknown_parts = set()
+        classic = False
+        new_parts = []
+        for part in parts:
+            if part["ID"] not in part_registry.INDEX:
+                current = part_registry.LEGACY_IDS.get(part["ID"])
+                if current is None:
+                    # Add the unknown part ID to the set and update it to "cosmoteer.UNKNOWN"
+                    unknown_parts.add(part["ID"])
+                    part["ID"] = "cosmoteer.UNKNOWN"
+                else:
+                    # Replace the part ID with its corresponding new ID and mirroring
+                    part["ID"], flip = current
+                    if flip is not None:
+                        part["FlipX"] = flip
+                    classic = True
             new_parts.append(part)
 
     # Generate the error message for unknown parts
@@ -918,7 +846,8 @@ def com(input_filename, output_filename,args):
 
     """
     # Read ship data and extract part data
-    decoded_data = cosmoteer_save_tools.Ship(input_filename).data
+    ship = cosmoteer_save_tools.Ship(input_filename, fields=["Parts", "FlightDirection"], cache=SHIP_CACHE)
+    decoded_data = ship.data
     parts = decoded_data["Parts"]
     ship_orientation = decoded_data["FlightDirection"]
     
@@ -935,7 +864,8 @@ def com(input_filename, output_filename,args):
     data_cot = [origin_thrust, thrust_vector, thrust_direction]
 
     # Draw ship and write to output image
-    base64_output = draw_ship(parts, data_com, data_cot, ship_orientation, output_filename, args)
+    layer_key = ship_cache.ShipCache.make_key(ship.compressed_image_data)
+    base64_output = draw_ship(parts, data_com, data_cot, ship_orientation, output_filename, args, layer_key)
 
     # Print results
     print("center of mass: ", data_com)
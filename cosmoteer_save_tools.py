@@ -22,12 +22,13 @@ from PIL import Image
 import numpy as np
 import gzip
 import struct
+import array
+import zlib
 import enum
-import io
 from io import BytesIO
 import base64
 import re
-import requests
+import ship_fetch
 
 
 class OBNodeType(enum.Enum):
@@ -38,37 +39,299 @@ class OBNodeType(enum.Enum):
     Link = 4
     Null = 5
 
+# limits protecting the process from hostile ships, real ships are far below them
+MAX_PAYLOAD_SIZE = 32 * 1024 * 1024 # bytes of decompressed payload
+MAX_NODES = 2_000_000 # OB nodes in the decoded tree
+MAX_DEPTH = 256 # nested ChildList and ChildMap nodes
+INFLATE_CHUNK_SIZE = 1 << 16 # compressed bytes fed to the decompressor at a time
+
+INT32 = struct.Struct('<i')
+UINT32 = struct.Struct('<I')
+FLOAT32 = struct.Struct('<f')
+LOCATION = struct.Struct('<ll')
+# Data nodes packed whole by Ship.encode: type 1, the varint of the size, then the value
+DATA_INT32 = struct.Struct('<BBi')
+DATA_UINT32 = struct.Struct('<BBI')
+DATA_FLOAT32 = struct.Struct('<BBf')
+DATA_BOOL = struct.Struct('<BB?')
+DATA_LOCATION = struct.Struct('<BBll')
+OB_UNSET, OB_DATA, OB_CHILD_LIST, OB_CHILD_MAP, OB_LINK, OB_NULL = (t.value for t in OBNodeType)
+ENCODE_KINDS = (bool, int, float, str, tuple, bytes, list, dict) # bool first, it is also an int
+ENCODE_INITIAL_SIZE = 1 << 16
+ENCODE_MAX_FIXED_SIZE = 16 # largest node written without a bounds check, a Data location is 10 bytes
+METADATA_FIELDS = ("Name", "Author", "FlightDirection")
+
+INT_KEYS = ('Rotation', 'Orientation', 'Version', 'FlightDirection', 'FormationOrder', 'Key', 'Max', 'Min', "ID")
+STRING_KEYS = ('ID', 'Name', 'Author', 'RoofBaseTexture', 'ShipRulesID', 'Description', 'ComponentID', 'PartID', 'IDString', "Value")
+COLOR_KEYS = ('Color', 'RoofBaseColor', 'RoofDecalColor1', 'RoofDecalColor2', 'RoofDecalColor3', 'CrewUniformColor')
+
+ANY_LENGTH_EXPANSION = 256
+
+def compile_value_converters() -> dict:
+    """
+    Build the table used by Ship.decode to convert the binary value of a ChildMap entry.
+
+    Keys are (key, length) pairs, a length of None matches values of any length and is only
+    used when there is no entry for the exact length. Each converter takes the buffer, the
+    position and the size of the value. Values without a converter are kept as raw bytes.
+
+    Rules for any length are also expanded for lengths below ANY_LENGTH_EXPANSION, so the
+    common case costs a single lookup.
+    """
+    int32 = lambda buffer, pos, size: INT32.unpack_from(buffer, pos)[0]
+    uint32 = lambda buffer, pos, size: UINT32.unpack_from(buffer, pos)[0]
+    float32 = lambda buffer, pos, size: FLOAT32.unpack_from(buffer, pos)[0]
+    location = lambda buffer, pos, size: list(LOCATION.unpack_from(buffer, pos))
+    boolean = lambda buffer, pos, size: bool(buffer[pos])
+    def string(buffer, pos, size):
+        if size and buffer[pos] == size - 1 < 0x80:
+            return str(buffer[pos + 1:pos + size], 'latin1')
+        # keep values that are not exactly one length-prefixed string as raw bytes
+        value = buffer[pos:pos + size]
+        text, end = Ship.read_string(value, 0)
+        return text if end == size else bytes(value)
+    color = lambda buffer, pos, size: tuple(buffer[i:i + 4].hex().upper() for i in range(pos, pos + 16, 4))
+
+    # listed from the lowest to the highest priority, later rules replace earlier ones
+    rules = [
+        (COLOR_KEYS, 16, color),
+        (STRING_KEYS, None, string),
+        (('FlipX', 'FlipY', "Value"), 1, boolean),
+        (('Location', 'Cell', "Key"), 8, location),
+        (('Value',), 4, uint32),
+        (('DefaultAttackRadius',), 4, uint32),
+        (('DefaultAttackRotation',), 4, float32),
+        (INT_KEYS, 4, int32),
+    ]
+    converters = {}
+    for keys, length, converter in rules:
+        for key in keys:
+            if length is None:
+                for expanded in range(ANY_LENGTH_EXPANSION):
+                    converters[(key, expanded)] = converter
+            converters[(key, length)] = converter
+    return converters
+
+VALUE_CONVERTERS = compile_value_converters()
+
+class ShipLimitError(ValueError):
+    """Raised when a ship exceeds MAX_PAYLOAD_SIZE, MAX_NODES or MAX_DEPTH."""
+
+class PartTable():
+    """
+    Columnar table of ship parts.
+
+    Each part is a row of the NumPy arrays, part types are interned: type_index
+    points into type_names.
+
+    Attributes:
+        type_names (list): Part IDs, for example "cosmoteer.armor".
+        type_index (numpy.ndarray): uint16 index into type_names of each part.
+        x (numpy.ndarray): int32 x coordinate of the upper left corner of each part.
+        y (numpy.ndarray): int32 y coordinate of the upper left corner of each part.
+        rotation (numpy.ndarray): int8 rotation of each part, 0, 1, 2 or 3.
+        flip_x (numpy.ndarray): bool, whether each part is mirrored.
+    """
+    def __init__(self, type_names, type_index, x, y, rotation, flip_x) -> None:
+        self.type_names = type_names
+        self.type_index = type_index
+        self.x = x
+        self.y = y
+        self.rotation = rotation
+        self.flip_x = flip_x
+
+    def __len__(self) -> int:
+        return len(self.type_index)
+
+    @property
+    def ids(self) -> list:
+        # part ID of each part
+        return [self.type_names[i] for i in self.type_index.tolist()]
+
+    def to_list(self) -> list:
+        """
+        Convert the table to the list of part dicts produced by Ship.decode.
+        """
+        return [
+            {"FlipX": flip, "ID": self.type_names[index], "Location": [x, y], "Rotation": rotation}
+            for index, x, y, rotation, flip in zip(
+                self.type_index.tolist(), self.x.tolist(), self.y.tolist(),
+                self.rotation.tolist(), self.flip_x.tolist())
+        ]
+
+    @classmethod
+    def from_list(cls, parts) -> "PartTable":
+        """
+        Build a table from a list of part dicts as produced by Ship.decode.
+        """
+        type_lookup = {}
+        type_index = [type_lookup.setdefault(part["ID"], len(type_lookup)) for part in parts]
+        return cls(
+            list(type_lookup),
+            np.array(type_index, np.uint16),
+            np.array([part["Location"][0] for part in parts], np.int32),
+            np.array([part["Location"][1] for part in parts], np.int32),
+            np.array([part.get("Rotation", 0) for part in parts], np.int8),
+            np.array([part.get("FlipX", False) for part in parts], np.bool_),
+        )
+
 class Ship():
-    def __init__(self, image_path) -> None:
+    def __init__(self, image_path, fields=None, part_table=False,
+                 max_payload_size=None, max_nodes=None, max_depth=None, cache=None) -> None:
+        """
+        Read and decode a ship.
+
+        Args:
+            image_path: Path, url or base64 string of the ship.png, its bytes, a binary file
+                object, a PIL image or a uint8 pixel array of shape (height, width, 3 or 4).
+                The from_* constructors take the non string inputs explicitly.
+            fields (iterable, optional): Only decode these top level keys, for example
+                ["Parts", "FlightDirection"]. Other subtrees are skipped without building
+                Python objects for them. A ship decoded this way cannot be written back.
+            part_table (bool, optional): Decode data["Parts"] as a PartTable instead of a list
+                of dicts. A ship decoded this way cannot be written back either.
+            max_payload_size (int, optional): Maximum size of the decompressed payload.
+                Defaults to MAX_PAYLOAD_SIZE.
+            max_nodes (int, optional): Maximum number of OB nodes. Defaults to MAX_NODES.
+            max_depth (int, optional): Maximum nesting of OB nodes. Defaults to MAX_DEPTH.
+            cache (ship_cache.ShipCache, optional): Cache of decoded ships. On a hit the payload
+                is neither decompressed nor decoded.
+
+        Raises:
+            ShipLimitError: If the ship exceeds one of the limits.
+        """
         self.image_path = image_path
+        self.fields = None if fields is None else frozenset(fields)
+        self.part_table = part_table
+        self.max_payload_size = max_payload_size
+        self._image = None
+        self._image_data = None
+        self._payload = None
         
-        # read image, base64 image or url
+        # read image, base64 image, url, bytes, file object, PIL image or pixel array
         input_type = check_input_type(image_path)
-        # print(input_type)
         if input_type == "base64":
-            self.image = Image.open(BytesIO(base64.b64decode(image_path))) # read base64 string
+            self._source = base64.b64decode(image_path) # read base64 string
         elif input_type == "file_path":
-            self.image = Image.open(image_path)
+            self._source = image_path
         elif input_type == "url":
-            response = requests.get(image_path)
-            self.image = Image.open(BytesIO(response.content))
-        
-        self.image_data = np.array(self.image.getdata())
+            self._source = ship_fetch.fetch(image_path)
+        elif input_type == "bytes":
+            self._source = image_path if isinstance(image_path, bytes) else bytes(image_path)
+        elif input_type == "file":
+            self._source = image_path.read() # the image may be reopened later by write()
+        elif input_type == "image":
+            self._source = None
+            self._image = image_path
+        elif input_type == "pixels":
+            if image_path.ndim != 3 or image_path.shape[2] not in (3, 4) or image_path.dtype != np.uint8:
+                raise ValueError("pixels must be a uint8 array of shape (height, width, 3 or 4)")
+            self._source = image_path
+            self._image_data = image_path.reshape(-1, image_path.shape[2])
+        else:
+            raise ValueError("ship must be a file path, a url, a base64 string, bytes, a file object, "
+                             "a PIL image or a pixel array")
 
-        self.compressed_image_data = self.read_bytes()
+        self.compressed_image_data = None
+        if input_type not in ("image", "pixels"):
+            with self.open_source() as file:
+                self.compressed_image_data = read_png_payload(file)
+        if self.compressed_image_data is None:
+            # already decoded, or a PNG layout not handled by the streaming reader
+            self.compressed_image_data = self.read_bytes()
         
+        self.version = 1
         if self.compressed_image_data[:9] == b'COSMOSHIP':
             self.compressed_image_data = self.compressed_image_data[9:]
             self.version = 2
 
-        self.buffer = io.BytesIO(gzip.decompress(self.compressed_image_data))
-        self.data = self.decode()
+        if cache is not None:
+            key = cache.make_key(self.compressed_image_data, self.fields, part_table)
+            self.data = cache.get(key)
+            if self.data is not None:
+                return
+        self.data = self.decode(fields=self.fields, part_table=part_table, max_nodes=max_nodes, max_depth=max_depth)
+        if cache is not None:
+            cache.put(key, self.data)
+
+    @classmethod
+    def from_bytes(cls, data, **kwargs) -> "Ship":
+        """Read a ship from the bytes (or bytearray / memoryview) of a ship.png."""
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            raise ValueError("data must be bytes, a bytearray or a memoryview")
+        return cls(data, **kwargs)
+
+    @classmethod
+    async def from_url_async(cls, url, max_download_size=None, **kwargs) -> "Ship":
+        """
+        Download a ship without blocking the event loop, then read it.
+
+        Args:
+            url (str): Url of the ship.png.
+            max_download_size (int, optional): Defaults to ship_fetch.MAX_DOWNLOAD_SIZE.
+            **kwargs: Passed to Ship.
+        """
+        return cls(await ship_fetch.fetch_async(url, max_download_size), **kwargs)
+
+    @classmethod
+    def from_file(cls, file, **kwargs) -> "Ship":
+        """Read a ship from a binary file object positioned at the start of a ship.png."""
+        if not hasattr(file, "read"):
+            raise ValueError("file must be a binary file object")
+        return cls(file, **kwargs)
+
+    @classmethod
+    def from_image(cls, image: Image.Image, **kwargs) -> "Ship":
+        """Read a ship from an already opened PIL image."""
+        if not isinstance(image, Image.Image):
+            raise ValueError("image must be a PIL image")
+        return cls(image, **kwargs)
+
+    @classmethod
+    def from_pixels(cls, pixels: np.ndarray, **kwargs) -> "Ship":
+        """Read a ship from decoded pixels, a uint8 array of shape (height, width, 3 or 4)."""
+        if not isinstance(pixels, np.ndarray):
+            raise ValueError("pixels must be a numpy array")
+        return cls(pixels, **kwargs)
+
+    def open_source(self):
+        if isinstance(self._source, bytes):
+            return BytesIO(self._source)
+        return open(self._source, "rb")
+
+    @property
+    def payload(self) -> bytes:
+        # decompressed lazily, a cache hit never needs it
+        if self._payload is None:
+            self._payload = inflate_payload(self.compressed_image_data, self.max_payload_size)
+        return self._payload
+
+    @property
+    def image(self) -> Image.Image:
+        # only decoded when the full image is needed, for example by write()
+        if self._image is None:
+            if isinstance(self._source, np.ndarray):
+                self._image = Image.fromarray(self._source)
+            else:
+                self._image = Image.open(self.open_source())
+        return self._image
+
+    @property
+    def image_data(self) -> np.ndarray:
+        # read-only uint8 view of the decoded pixels, shape (N, channels)
+        if self._image_data is None:
+            self._image_data = pixel_view(self.image)
+        return self._image_data
 
     def write(self, new_image: Image.Image = None) -> Image.Image:
+        if self.fields is not None or self.part_table:
+            raise ValueError("a ship decoded with a field projection or a part table cannot be written")
         if new_image is None:
+            image = self.image
             self.in_image = self.image_data.copy()
         else:
-            self.in_image = np.array(new_image.getdata())
+            image = new_image
+            self.in_image = pixel_view(new_image).copy()
 
         data = self.encode(self.data)
         compressed = gzip.compress(data, 6)
@@ -79,36 +342,17 @@ class Ship():
             compressed = bytes(b_compressed)
 
         self.write_bytes(compressed)
-        return Image.fromarray(self.in_image.reshape((*self.image.size, 4)).astype(np.uint8))
+        return Image.fromarray(self.in_image.reshape((image.height, image.width, -1)))
 
 
     def read_bytes(self) -> bytes:
-        data = [byte for pixel in self.image_data for byte in pixel[:3]]
-        length = int.from_bytes(bytes([self.get_byte(i, data) for i in range(4)]), "big")
-        return bytes([self.get_byte(i + 4, data) for i in range(length)])
-
-    def get_byte(self, offset, data) -> int:
-        out_byte = 0
-        for bits_right in range(8):
-            out_byte |= (data[offset * 8 + bits_right] & 1) << bits_right
-        return out_byte
+        return extract_payload(self.image_data)
 
     def write_bytes(self, in_bytes) -> None:
-        in_bytes = len(in_bytes).to_bytes(4, "big") + in_bytes
-        for offset, byte in enumerate(in_bytes):
-            self.set_byte(offset, byte)
-
-    def set_byte(self, offset, byte) -> None:
-        for bits_right in range(8):
-            image_offset = offset * 8 + bits_right
-            rgb = image_offset % 3
-            pixel_offset = (offset * 8 + bits_right) // 3
-            mask = (1 << 8) - 2
-            bit = (byte >> bits_right) & 1
-            self.in_image[pixel_offset][rgb] = (self.in_image[pixel_offset][rgb] & mask) | bit
-
-    def read_varint(self, file: io.BytesIO) -> int:
-        byte = file.read(1)[0]
+        embed_payload(self.in_image, in_bytes)
+
+    def read_varint(self, buffer: memoryview, pos: int) -> tuple:
+        byte = buffer[pos]
         count = 1
         if byte & 1 != 0:
             count += 1
@@ -118,9 +362,9 @@ class Ship():
                     count += 1
         
         for i in range(1, count):
-            byte |= file.read(1)[0] << (i * 8)
+            byte |= buffer[pos + i] << (i * 8)
 
-        return byte >> min(count, 3)
+        return byte >> min(count, 3), pos + count
 
     def write_varint(self, val, byte_data=None) -> bytearray:
         if byte_data is None:
@@ -149,11 +393,13 @@ class Ship():
         
         return byte_data
 
-    def read_string(self, file: bytearray) -> str: 
+    @staticmethod
+    def read_string_length(buffer: memoryview, pos: int) -> tuple:
         length = 0
         i = 0
         while True:
-            byte = file.read(1)[0]
+            byte = buffer[pos]
+            pos += 1
             length |= (byte & 0x7F) << (i * 7)
             if byte & 0x80 == 0:
                 break
@@ -162,10 +408,14 @@ class Ship():
                 break
             i += 1
 
-        data = file.read(length)
-        data = data.decode('latin1')
+        return length, pos
 
-        return data
+    @staticmethod
+    def read_string(buffer: memoryview, pos: int) -> tuple:
+        length, pos = Ship.read_string_length(buffer, pos)
+        data = str(buffer[pos:pos + length], 'latin1')
+
+        return data, pos + length
 
     def write_string(self, text, byte_data=None) -> bytearray:
         if byte_data is None:
@@ -173,7 +423,7 @@ class Ship():
 
         num = len(text)
         while (num >= 0x80):
-            byte_data.append(num | 0x80)
+            byte_data.append((num & 0x7F) | 0x80)
             num = num >> 7
         
         byte_data.append(num)
@@ -183,129 +433,432 @@ class Ship():
     def is_2int_list(self, data):
         return isinstance(data, list) and len(data) == 2 and all([isinstance(x, int) for x in data])
 
-    def decode(self):
-        _type = self.buffer.read(1)[0]
-        if _type == OBNodeType.Unset.value:
-            return "Unset"
-
-        elif _type == OBNodeType.Data.value:
-            size = self.read_varint(self.buffer)
-            return self.buffer.read(size)
-
-        elif _type == OBNodeType.ChildList.value:
-            count = self.read_varint(self.buffer)
-            lst = []
-            for _ in range(count):
-                elem = self.decode()
-                lst.append(elem)
-            return lst
-
-        elif _type == OBNodeType.ChildMap.value:
-            count = self.read_varint(self.buffer)
-            d = {}
-            for _ in range(count):
-                key = self.read_string(self.buffer)
-                value = self.decode()
-                if isinstance(value, bytes):
-                    if (
-                        key in ('Rotation', 'Orientation', 'Version', 'FlightDirection', 'FormationOrder', 'Key', 'Max', 'Min', "ID")
-                        and len(value) == 4
-                    ):
-                        value = struct.unpack('<i', value)[0]
-                    elif key == 'DefaultAttackRotation':
-                        value = struct.unpack('<f', value)[0]
-                        # print(self.image_path)
-                        # print('DefaultAttackRotation: ', value)
-                    elif key == 'DefaultAttackRadius':
-                        value = struct.unpack('<I', value)[0]
-                        # print('DefaultAttackRadius: ', value)
-                    elif key == 'Value' and len(value) == 4:
-                        value = struct.unpack('<I', value)[0]
-                    elif key in ('Location', 'Cell', "Key") and len(value) == 8:
-                        value = list(struct.unpack('<ll', value))
-                    elif key in ('FlipX', 'FlipY', "Value") and len(value) == 1:
-                        value = bool(value[0])
-                    elif key in ('ID', 'Name', 'Author', 'RoofBaseTexture', 'ShipRulesID', 'Description', 'ComponentID', 'PartID', 'IDString', "Value"):
-                        value = self.read_string(io.BytesIO(value))
-                    elif key in ('Color', 'RoofBaseColor', 'RoofDecalColor1', 'RoofDecalColor2', 'RoofDecalColor3', 'CrewUniformColor') and len(value) == 16:
-                        c1 = value[0:4].hex().upper()
-                        c2 = value[4:8].hex().upper()
-                        c3 = value[8:12].hex().upper()
-                        c4 = value[12:16].hex().upper()
-                        value = (c1, c2, c3, c4)
-                    else:
-                        # print('Unhandled key with binary value:', {key: value})
+    def decode(self, buffer: memoryview = None, fields=None, part_table=False, max_nodes=None, max_depth=None):
+        """
+        Decode an OB node tree.
+
+        The payload is walked with an integer cursor over a memoryview and containers are
+        tracked on an explicit stack, so deeply nested trees cannot hit the recursion limit.
+        Data nodes are only copied when they are kept as raw bytes.
+
+        Args:
+            buffer (memoryview, optional): The serialized tree. Defaults to the ship payload.
+            fields (set, optional): Keys of the root ChildMap to decode, the other entries
+                are skipped. Decoding stops as soon as all of them have been read.
+            part_table (bool, optional): Decode the root "Parts" list straight into a PartTable.
+            max_nodes (int, optional): Maximum number of nodes. Defaults to MAX_NODES.
+            max_depth (int, optional): Maximum nesting of containers. Defaults to MAX_DEPTH.
+
+        Raises:
+            ShipLimitError: If the tree has too many nodes or is nested too deeply.
+
+        Returns:
+            The decoded root node.
+        """
+        if buffer is None:
+            buffer = memoryview(self.payload)
+        if max_nodes is None:
+            max_nodes = MAX_NODES
+        if max_depth is None:
+            max_depth = MAX_DEPTH
+        read_varint = self.read_varint
+        read_string = self.read_string
+        converters = VALUE_CONVERTERS
+        UNSET, DATA, CHILD_LIST, CHILD_MAP, LINK, NULL = (t.value for t in OBNodeType)
+
+        pos = 0
+        root = None
+        # one [container, remaining children, is_map] frame per open ChildList or ChildMap
+        stack = []
+        parent = None
+        top = None # root frame, only tracked when projecting fields or building a part table
+        nodes = 1 # nodes announced by the containers seen so far, checked before decoding them
+        missing = None # projected fields not read yet
+        while True:
+            key = None
+            if parent is not None and parent[2]:
+                if parent is top and missing is not None and not missing:
+                    return root
+                length = buffer[pos]
+                if length < 0x80:
+                    pos += 1
+                    key = str(buffer[pos:pos + length], 'latin1')
+                    pos += length
+                else:
+                    key, pos = read_string(buffer, pos)
+                if parent is top:
+                    if missing is not None:
+                        if key not in fields:
+                            pos, nodes = self.skip_node(buffer, pos, nodes, len(stack), max_nodes, max_depth)
+                            parent[1] -= 1
+                            if parent[1] == 0:
+                                return root
+                            continue
+                        missing.discard(key)
+                    if part_table and key == "Parts":
+                        parent[0][key], pos, nodes = self.decode_part_table(
+                            buffer, pos, nodes, len(stack), max_nodes, max_depth)
+                        parent[1] -= 1
+                        if parent[1] == 0:
+                            return root
                         continue
 
-                d[key] = value
-            return d
-        elif _type == OBNodeType.Link.value:
-            subtype = self.buffer.read(1)[0]
-            if subtype == 255:
-                _id = self.read_varint(self.buffer)
-                return {'_type': 'link', '_id': _id}
-            elif subtype == 254:
-                return None
-        if _type == OBNodeType.Null.value:
-            return None
-        else:
-            raise TypeError(f'Unexpected type {_type}')
+            _type = buffer[pos]
+            pos += 1
+            children = 0
+            if _type == DATA:
+                size = buffer[pos]
+                if size & 1:
+                    size, pos = read_varint(buffer, pos)
+                else:
+                    size >>= 1
+                    pos += 1
+                converter = None
+                if key is not None:
+                    converter = converters.get((key, size)) or converters.get((key, None))
+                if converter is None:
+                    value = bytes(buffer[pos:pos + size])
+                else:
+                    value = converter(buffer, pos, size)
+                pos += size
+
+            elif _type == CHILD_MAP or _type == CHILD_LIST:
+                children, pos = read_varint(buffer, pos)
+                value = {} if _type == CHILD_MAP else []
+
+            elif _type == UNSET:
+                value = "Unset"
+
+            elif _type == LINK:
+                subtype = buffer[pos]
+                pos += 1
+                if subtype == 255:
+                    _id, pos = read_varint(buffer, pos)
+                    value = {'_type': 'link', '_id': _id}
+                elif subtype == 254:
+                    value = None
+                else:
+                    raise TypeError(f'Unexpected type {_type}')
+
+            elif _type == NULL:
+                value = None
+
+            else:
+                raise TypeError(f'Unexpected type {_type}')
+
+            if parent is None:
+                root = value
+                if fields is not None:
+                    if _type != CHILD_MAP:
+                        raise TypeError('fields can only be projected from a ChildMap root')
+                    missing = set(fields)
+            else:
+                if key is None:
+                    parent[0].append(value)
+                else:
+                    parent[0][key] = value
+                parent[1] -= 1
+
+            if children:
+                nodes += children
+                if nodes > max_nodes:
+                    raise ShipLimitError(f"ship has more than {max_nodes} nodes")
+                if len(stack) >= max_depth:
+                    raise ShipLimitError(f"ship nodes are nested more than {max_depth} levels deep")
+                parent = [value, children, _type == CHILD_MAP]
+                stack.append(parent)
+                if root is value and (fields is not None or part_table):
+                    top = parent
+            elif parent is not None and parent[1] == 0:
+                stack.pop()
+                while stack and stack[-1][1] == 0:
+                    stack.pop()
+                parent = stack[-1] if stack else None
+            if parent is None:
+                return root
+
+    def decode_part_table(self, buffer: memoryview, pos: int, nodes: int = 1, depth: int = 0,
+                          max_nodes: int = MAX_NODES, max_depth: int = MAX_DEPTH) -> tuple:
+        """
+        Decode a ChildList of parts straight into a PartTable, without building a dict per part.
+
+        Part entries other than ID, Location, Rotation and FlipX are skipped.
+
+        Args:
+            buffer (memoryview): The serialized tree.
+            pos (int): Position of the ChildList node.
+            nodes (int, optional): Nodes counted so far, see decode.
+            depth (int, optional): Number of containers enclosing the list.
+            max_nodes (int, optional): Maximum number of nodes. Defaults to MAX_NODES.
+            max_depth (int, optional): Maximum nesting of containers. Defaults to MAX_DEPTH.
+
+        Raises:
+            ShipLimitError: If the parts have too many nodes or are nested too deeply.
+
+        Returns:
+            tuple: The PartTable, the position right after the list and the updated node count.
+        """
+        read_varint = self.read_varint
+        read_string = self.read_string
+        DATA = OBNodeType.Data.value
+        if buffer[pos] != OBNodeType.ChildList.value:
+            raise TypeError('Parts is not a ChildList')
+        count, pos = read_varint(buffer, pos + 1)
+        nodes += count
+        if nodes > max_nodes:
+            raise ShipLimitError(f"ship has more than {max_nodes} nodes")
+        if count and depth >= max_depth:
+            raise ShipLimitError(f"ship nodes are nested more than {max_depth} levels deep")
+
+        type_names = []
+        type_lookup = {} # serialized ID -> index in type_names
+        type_index = array.array('H')
+        xs = array.array('i')
+        ys = array.array('i')
+        rotations = array.array('b')
+        flips = bytearray()
+        for _ in range(count):
+            if buffer[pos] != OBNodeType.ChildMap.value:
+                raise TypeError(f'Unexpected part node type {buffer[pos]}')
+            entries, pos = read_varint(buffer, pos + 1)
+            nodes += entries
+            if nodes > max_nodes:
+                raise ShipLimitError(f"ship has more than {max_nodes} nodes")
+            if entries and depth + 1 >= max_depth:
+                raise ShipLimitError(f"ship nodes are nested more than {max_depth} levels deep")
+            part_type, x, y, rotation, flip = None, 0, 0, 0, 0
+            for _ in range(entries):
+                length = buffer[pos]
+                if length < 0x80:
+                    key = str(buffer[pos + 1:pos + 1 + length], 'latin1')
+                    pos += length + 1
+                else:
+                    key, pos = read_string(buffer, pos)
+                if buffer[pos] != DATA:
+                    pos, nodes = self.skip_node(buffer, pos, nodes, depth + 2, max_nodes, max_depth)
+                    continue
+                size = buffer[pos + 1]
+                if size & 1:
+                    size, pos = read_varint(buffer, pos + 1)
+                else:
+                    size >>= 1
+                    pos += 2
+                if key == 'ID':
+                    raw = bytes(buffer[pos:pos + size])
+                    part_type = type_lookup.get(raw)
+                    if part_type is None:
+                        part_type = type_lookup[raw] = len(type_names)
+                        type_names.append(read_string(buffer, pos)[0])
+                elif key == 'Location' and size == 8:
+                    x, y = LOCATION.unpack_from(buffer, pos)
+                elif key == 'Rotation' and size == 4:
+                    rotation = INT32.unpack_from(buffer, pos)[0]
+                elif key == 'FlipX' and size == 1:
+                    flip = buffer[pos] != 0
+                pos += size
+            if part_type is None:
+                raise TypeError('part without an ID')
+            type_index.append(part_type)
+            xs.append(x)
+            ys.append(y)
+            rotations.append(rotation)
+            flips.append(flip)
+
+        return PartTable(
+            type_names,
+            np.frombuffer(type_index, np.uint16),
+            np.frombuffer(xs, np.int32),
+            np.frombuffer(ys, np.int32),
+            np.frombuffer(rotations, np.int8),
+            np.frombuffer(flips, np.bool_),
+        ), pos, nodes
+
+    def skip_node(self, buffer: memoryview, pos: int, nodes: int = 1, depth: int = 0,
+                  max_nodes: int = MAX_NODES, max_depth: int = MAX_DEPTH) -> tuple:
+        """
+        Skip a whole node and its children without decoding them.
+
+        Skipped nodes count against the same limits as decoded ones.
+
+        Args:
+            buffer (memoryview): The serialized tree.
+            pos (int): Position of the node.
+            nodes (int, optional): Nodes counted so far, including this one, see decode.
+            depth (int, optional): Number of containers enclosing the node.
+            max_nodes (int, optional): Maximum number of nodes. Defaults to MAX_NODES.
+            max_depth (int, optional): Maximum nesting of containers. Defaults to MAX_DEPTH.
+
+        Raises:
+            ShipLimitError: If the node has too many children or is nested too deeply.
+
+        Returns:
+            tuple: The position right after the node and the updated node count.
+        """
+        read_varint = self.read_varint
+        DATA, CHILD_LIST, CHILD_MAP, LINK = (t.value for t in (
+            OBNodeType.Data, OBNodeType.ChildList, OBNodeType.ChildMap, OBNodeType.Link))
+
+        # (remaining children, is_map) of the enclosing containers
+        stack = []
+        remaining, is_map = 1, False
+        while True:
+            if remaining == 0:
+                if not stack:
+                    return pos, nodes
+                remaining, is_map = stack.pop()
+                continue
+            remaining -= 1
+            if is_map:
+                length = buffer[pos]
+                if length < 0x80:
+                    pos += length + 1
+                else:
+                    length, pos = self.read_string_length(buffer, pos)
+                    pos += length
+
+            _type = buffer[pos]
+            pos += 1
+            if _type == DATA:
+                size = buffer[pos]
+                if size & 1:
+                    size, pos = read_varint(buffer, pos)
+                    pos += size
+                else:
+                    pos += (size >> 1) + 1
+            elif _type == CHILD_LIST or _type == CHILD_MAP:
+                count, pos = read_varint(buffer, pos)
+                if count:
+                    nodes += count
+                    if nodes > max_nodes:
+                        raise ShipLimitError(f"ship has more than {max_nodes} nodes")
+                    if depth + len(stack) >= max_depth:
+                        raise ShipLimitError(f"ship nodes are nested more than {max_depth} levels deep")
+                    stack.append((remaining, is_map))
+                    remaining, is_map = count, _type == CHILD_MAP
+            elif _type == LINK:
+                subtype = buffer[pos]
+                pos += 1
+                if subtype == 255:
+                    _, pos = read_varint(buffer, pos)
+                elif subtype != 254:
+                    raise TypeError(f'Unexpected type {_type}')
+            elif _type not in (OBNodeType.Unset.value, OBNodeType.Null.value):
+                raise TypeError(f'Unexpected type {_type}')
 
     def encode(self, data_node, byte_data: bytearray=None) -> bytearray:
-        if byte_data is None:
-            byte_data = bytearray()
+        """
+        Encode a tree of decoded values back into OB nodes.
 
-        if data_node == "Unset":
-            byte_data.append(OBNodeType.Unset.value)
-            return byte_data
-        
-        elif isinstance(data_node, (str, int, float, bool, tuple, bytes)) or self.is_2int_list(data_node):
-            byte_data.append(OBNodeType.Data.value)
-            
-            if isinstance(data_node, str):
-                string_data = self.write_string(data_node)
-                byte_data = self.write_varint(len(string_data), byte_data)
-                byte_data.extend(string_data)
-                return byte_data
-            elif isinstance(data_node, bool):
-                data = bytearray([data_node])
-            elif isinstance(data_node, int):
-                data = struct.pack("<i", data_node)
-            elif isinstance(data_node, float):
-                data = struct.pack("<f", data_node)
-            elif isinstance(data_node, tuple):
-                data = bytearray.fromhex("".join(data_node))
-            elif isinstance(data_node, list):
-                data = struct.pack("<ll", *data_node)
-            else: 
-                data = data_node
-
-            byte_data = self.write_varint(len(data), byte_data)
-            byte_data.extend(data)
-            return byte_data
-
-        elif isinstance(data_node, list):
-            byte_data.append(OBNodeType.ChildList.value)
-            byte_data = self.write_varint(len(data_node), byte_data)
-            for x in data_node:
-                byte_data = self.encode(x, byte_data)
-            return byte_data
-
-        elif isinstance(data_node, dict):
-            byte_data.append(OBNodeType.ChildMap.value)
-            byte_data = self.write_varint(len(data_node), byte_data)
-
-            for key in data_node.keys():
-                byte_data = self.write_string(key, byte_data)
-                byte_data = self.encode(data_node[key], byte_data)
-            return byte_data
-
-        elif data_node is None:
-            byte_data.append(OBNodeType.Null.value)
-            return byte_data
-        
-        else:
-            raise TypeError(f"Unknown datatype: {type(data_node)}")
+        The tree is walked with an explicit stack and written into one buffer that grows by
+        doubling. Fixed size values are packed in place together with their Data header, and
+        the encoded form of keys, strings and colors is cached for the duration of the call.
+
+        Args:
+            data_node: The root node, usually Ship.data.
+            byte_data (bytearray, optional): Buffer the nodes are appended to.
+
+        Returns:
+            bytearray: The encoded nodes, appended to byte_data if it was given.
+        """
+        write_varint = self.write_varint
+        write_string = self.write_string
+        key_cache = {}
+        value_cache = {}
+
+        buf = bytearray(ENCODE_INITIAL_SIZE)
+        pos = 0
+        stack = [(iter((data_node,)), False)]
+        while stack:
+            items, is_map = stack[-1]
+            for node in items:
+                if pos + ENCODE_MAX_FIXED_SIZE > len(buf):
+                    buf += bytes(len(buf))
+
+                if is_map:
+                    key, node = node
+                    encoded = key_cache.get(key)
+                    if encoded is None:
+                        encoded = key_cache[key] = bytes(write_string(key))
+                    end = pos + len(encoded)
+                    buf[pos:end] = encoded
+                    pos = end
+                    if pos + ENCODE_MAX_FIXED_SIZE > len(buf):
+                        buf += bytes(len(buf))
+
+                kind = node.__class__
+                if kind not in ENCODE_KINDS:
+                    kind = next((k for k in ENCODE_KINDS if isinstance(node, k)), kind)
+
+                if kind is int:
+                    # unsigned values such as Value or DefaultAttackRadius can exceed the int32 range
+                    (DATA_INT32 if node < 0x80000000 else DATA_UINT32).pack_into(buf, pos, 1, 8, node)
+                    pos += 6
+                elif kind is str or kind is tuple:
+                    if node == "Unset":
+                        buf[pos] = OB_UNSET
+                        pos += 1
+                        continue
+                    encoded = value_cache.get(node)
+                    if encoded is None:
+                        if kind is str:
+                            data = write_string(node)
+                        else:
+                            data = bytearray.fromhex("".join(node))
+                        encoded = bytearray([OB_DATA])
+                        write_varint(len(data), encoded)
+                        encoded = value_cache[node] = bytes(encoded + data)
+                    end = pos + len(encoded)
+                    buf[pos:end] = encoded
+                    pos = end
+                elif kind is list:
+                    if len(node) == 2 and isinstance(node[0], int) and isinstance(node[1], int):
+                        DATA_LOCATION.pack_into(buf, pos, 1, 16, node[0], node[1])
+                        pos += 10
+                        continue
+                    encoded = write_varint(len(node), bytearray([OB_CHILD_LIST]))
+                    end = pos + len(encoded)
+                    buf[pos:end] = encoded
+                    pos = end
+                    stack.append((iter(node), False))
+                    break
+                elif kind is dict:
+                    if node.get('_type') == 'link':
+                        encoded = write_varint(node['_id'], bytearray([OB_LINK, 255]))
+                        end = pos + len(encoded)
+                        buf[pos:end] = encoded
+                        pos = end
+                        continue
+                    encoded = write_varint(len(node), bytearray([OB_CHILD_MAP]))
+                    end = pos + len(encoded)
+                    buf[pos:end] = encoded
+                    pos = end
+                    stack.append((iter(node.items()), True))
+                    break
+                elif kind is bool:
+                    DATA_BOOL.pack_into(buf, pos, 1, 2, node)
+                    pos += 3
+                elif kind is float:
+                    DATA_FLOAT32.pack_into(buf, pos, 1, 8, node)
+                    pos += 6
+                elif kind is bytes:
+                    encoded = write_varint(len(node), bytearray([OB_DATA]))
+                    encoded += node
+                    end = pos + len(encoded)
+                    buf[pos:end] = encoded
+                    pos = end
+                elif node is None:
+                    buf[pos] = OB_NULL
+                    pos += 1
+                else:
+                    raise TypeError(f"Unknown datatype: {type(node)}")
+            else:
+                stack.pop()
+
+        del buf[pos:]
+        if byte_data is None:
+            return buf
+        byte_data += buf
+        return byte_data
 
 if(JSON_ON):
     class JSONEncoderWithBytes(json.JSONEncoder):
@@ -315,26 +868,293 @@ if(JSON_ON):
                 # wrapped in a special dictionary:
                 return {'__bytes__': obj.decode('latin1')}
             return json.JSONEncoder.default(self, obj)
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_MODES = {2: "RGB", 6: "RGBA"} # 8 bit color types handled by read_png_payload
+PNG_BATCH_SIZE = 1 << 16 # bytes of scanlines inflated and un-filtered at a time
+PNG_MAX_WIDTH = 1 << 16 # pixels, a row is un-filtered whole so it bounds the memory of read_png_payload
+
+def inflate_payload(compressed, max_size=None) -> bytes:
+    """
+    Decompress a gzip payload incrementally, failing as soon as it grows past max_size.
+
+    Args:
+        compressed (bytes): The gzip compressed payload.
+        max_size (int, optional): Maximum decompressed size. Defaults to MAX_PAYLOAD_SIZE.
+
+    Returns:
+        bytes: The decompressed payload.
+
+    Raises:
+        ShipLimitError: If the payload decompresses to more than max_size bytes.
+    """
+    if max_size is None:
+        max_size = MAX_PAYLOAD_SIZE
+    out = bytearray()
+    pos = 0
+    while pos < len(compressed):
+        # gzip allows several members one after the other
+        inflater = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        tail = b""
+        while not inflater.eof:
+            if not tail:
+                if pos >= len(compressed):
+                    raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+                tail = compressed[pos:pos + INFLATE_CHUNK_SIZE]
+                pos += len(tail)
+            out += inflater.decompress(tail, max_size + 1 - len(out))
+            tail = inflater.unconsumed_tail
+            if len(out) > max_size:
+                raise ShipLimitError(f"ship payload decompresses to more than {max_size} bytes")
+        pos -= len(inflater.unused_data)
+        # like gzip.decompress, NUL padding after a member is not another member
+        while pos < len(compressed):
+            padding = compressed[pos:pos + INFLATE_CHUNK_SIZE]
+            stripped = len(padding) - len(padding.lstrip(b"\x00"))
+            pos += stripped
+            if stripped < len(padding):
+                break
+    return bytes(out)
+
+def png_chunks(file):
+    """
+    Iterate over the (type, data) chunks of a PNG file, stopping after IEND.
+    """
+    while True:
+        header = file.read(8)
+        if len(header) < 8:
+            return
+        length, chunk_type = struct.unpack(">I4s", header)
+        data = file.read(length)
+        file.read(4) # crc
+        yield chunk_type, data
+        if chunk_type == b"IEND":
+            return
+
+def png_scanlines(idat_chunks, batch_size):
+    """
+    Inflate IDAT data incrementally and yield it in blocks of batch_size bytes.
+    The last block holds whatever is left.
+    """
+    inflater = zlib.decompressobj()
+    pending = b""
+    for data in idat_chunks:
+        while True:
+            pending += inflater.decompress(data, batch_size - len(pending))
+            data = inflater.unconsumed_tail
+            if len(pending) == batch_size:
+                yield pending
+                pending = b""
+            elif not data:
+                break
+    pending += inflater.flush()
+    if pending:
+        yield pending
+
+def unfilter_scanlines(scanlines, prior, width, mode) -> np.ndarray:
+    """
+    Undo the PNG filters of a block of scanlines.
+
+    The previous un-filtered row is prepended as an unfiltered scanline so that
+    Up, Average and Paeth filters of the first row see it. The block is wrapped
+    in a stored (level 0) zlib stream and handed to the PIL png decoder, which
+    does the actual un-filtering.
+
+    Args:
+        scanlines (bytes): Whole filtered scanlines, each starting with its filter type byte.
+        prior (bytes): The un-filtered row above the block, zeros for the first row.
+        width (int): Image width in pixels.
+        mode (str): "RGB" or "RGBA".
+
+    Returns:
+        numpy.ndarray: The pixels of the block, shape (rows, width, channels).
+    """
+    rows = len(scanlines) // (len(prior) + 1)
+    data = zlib.compress(b"\x00" + prior + scanlines, 0)
+    block = Image.frombytes(mode, (width, rows + 1), data, "zip", mode)
+    return np.asarray(block)[1:]
+
+def read_png_payload(file) -> bytes:
+    """
+    Extract the ship payload from a PNG file without decoding the whole image.
+
+    Scanlines are inflated and un-filtered a block at a time, and reading stops
+    as soon as the rows holding the payload have been seen, so only a few rows
+    are kept in memory. The image size is checked against PIL's decompression bomb
+    limit and PNG_MAX_WIDTH before anything is allocated.
+
+    Args:
+        file: Binary file object positioned at the start of the PNG.
+
+    Returns:
+        bytes: The payload without its length header, or None if the PNG is not
+        an 8 bit, non interlaced RGB or RGBA image and must be decoded with PIL.
+
+    Raises:
+        PIL.Image.DecompressionBombError: If the image has more than Image.MAX_IMAGE_PIXELS pixels.
+        ShipLimitError: If the image is wider than PNG_MAX_WIDTH.
+    """
+    if file.read(8) != PNG_SIGNATURE:
+        return None
+    chunks = png_chunks(file)
+    chunk_type, ihdr = next(chunks, (None, None))
+    if chunk_type != b"IHDR":
+        return None
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", ihdr)
+    if bit_depth != 8 or color_type not in PNG_MODES or interlace != 0:
+        return None
+    if Image.MAX_IMAGE_PIXELS is not None and width * height > Image.MAX_IMAGE_PIXELS:
+        raise Image.DecompressionBombError(
+            f"image size ({width * height} pixels) exceeds limit of {Image.MAX_IMAGE_PIXELS} pixels")
+    if width > PNG_MAX_WIDTH:
+        raise ShipLimitError(f"image is {width} pixels wide, more than {PNG_MAX_WIDTH}")
+    mode = PNG_MODES[color_type]
+    row_size = width * len(mode)
+    stride = row_size + 1
+    batch_size = max(1, PNG_BATCH_SIZE // stride) * stride
+
+    idat_chunks = (data for chunk_type, data in chunks if chunk_type == b"IDAT")
+    prior = bytes(row_size)
+    payload = bytearray()
+    carry = np.empty(0, np.uint8) # bits that did not fill a whole byte yet
+    needed = None
+    seen = 0
+    for scanlines in png_scanlines(idat_chunks, batch_size):
+        scanlines = scanlines[:len(scanlines) // stride * stride]
+        if not scanlines:
+            break
+        pixels = unfilter_scanlines(scanlines, prior, width, mode)
+        prior = pixels[-1].tobytes()
+        pixels = pixels.reshape(-1, len(mode))
+        if needed is not None:
+            pixels = pixels[:needed - seen]
+        seen += len(pixels)
+
+        bits = np.concatenate((carry, pixels[:, :3].reshape(-1) & 1))
+        whole = len(bits) // 8 * 8
+        payload += np.packbits(bits[:whole], bitorder="little").tobytes()
+        carry = bits[whole:]
+
+        if needed is None and len(payload) >= 4:
+            length = int.from_bytes(payload[:4], "big")
+            needed = payload_pixel_count(length)
+            if needed > width * height:
+                raise ValueError(f"payload length {length} exceeds image capacity of {width * height * 3 // 8 - 4} bytes")
+        if needed is not None and seen >= needed:
+            return bytes(payload[4:4 + length])
+    raise ValueError("PNG data ended before the end of the payload")
+
+def embed_payload(pixels, payload) -> None:
+    """
+    Hide a payload and its 4 byte length header in the low bit of the RGB channels, in place.
+
+    This is the inverse of extract_payload, pixels past the end of the payload are left untouched.
+
+    Args:
+        pixels (numpy.ndarray): Writable uint8 pixel array of shape (N, 3) or (N, 4).
+        payload (bytes): The payload to hide.
+    """
+    needed = payload_pixel_count(len(payload))
+    if needed > len(pixels):
+        raise ValueError(f"payload of {len(payload)} bytes exceeds image capacity of {len(pixels) * 3 // 8 - 4} bytes")
+    data = len(payload).to_bytes(4, "big") + payload
+    bits = np.unpackbits(np.frombuffer(data, np.uint8), bitorder="little")
+    region = pixels[:needed, :3]
+    # the last pixel may hold fewer than 3 payload bits, keep its other low bits
+    low_bits = region.reshape(-1) & 1
+    low_bits[:len(bits)] = bits
+    pixels[:needed, :3] = (region & 0xFE) | low_bits.reshape(needed, 3)
+
+def pixel_view(image: Image.Image) -> np.ndarray:
+    """
+    Return the pixels of an image as a read-only uint8 array of shape (N, channels).
+
+    RGB and RGBA images are exposed as they are, other modes are converted to RGBA first.
+    """
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+    return np.asarray(image).reshape(-1, len(image.mode))
+
+HEADER_PIXELS = 11 # pixels holding the 32 bits of the payload length
+
+def payload_pixel_count(length) -> int:
+    """
+    Number of pixels needed to hold a payload of the given length and its 4 byte header.
+    """
+    return -(-(length + 4) * 8 // 3)
+
+def unpack_lsb(pixels) -> np.ndarray:
+    """
+    Pack the low bit of the RGB channels of the given pixels into bytes, least significant bit first.
+    """
+    bits = np.asarray(pixels)[:, :3].reshape(-1) & 1
+    return np.packbits(bits.astype(np.uint8), bitorder="little")
+
+def read_payload_length(pixels) -> int:
+    """
+    Read the big endian payload length stored in the first pixels of the image.
+    """
+    return int.from_bytes(unpack_lsb(pixels[:HEADER_PIXELS])[:4].tobytes(), "big")
+
+def extract_payload(pixels) -> bytes:
+    """
+    Extract the length-prefixed payload hidden in the low bit of the RGB channels.
+
+    Bits are stored least significant first, filling the R, G and B channels of
+    each pixel in order. The first 4 bytes are the big endian payload length.
+    The length is read first so only the pixels that carry the payload are decoded.
+
+    Args:
+        pixels (numpy.ndarray): Pixel array of shape (N, 3) or (N, 4).
+
+    Returns:
+        bytes: The payload without its length header.
+    """
+    if len(pixels) < HEADER_PIXELS:
+        raise ValueError("image is too small to hold a payload")
+    length = read_payload_length(pixels)
+    needed = payload_pixel_count(length)
+    if needed > len(pixels):
+        raise ValueError(f"payload length {length} exceeds image capacity of {len(pixels) * 3 // 8 - 4} bytes")
+    return unpack_lsb(pixels[:needed])[4:4 + length].tobytes()
+
+def read_metadata(image_path) -> dict:
+    """
+    Read only the name, author and flight direction of a ship.
+    """
+    return Ship(image_path, fields=METADATA_FIELDS).data
+
+BASE64_PNG_PREFIX = base64.b64encode(PNG_SIGNATURE)[:10].decode() # "iVBORw0KGg"
+
 def check_input_type(input_value):
-    # Check if it's a valid base64 string
-    try:
-        if base64.b64encode(base64.b64decode(input_value)) == input_value.encode():
-            return "base64"
-    except Exception:
-        pass
+    """
+    Classify a ship input with cheap type and prefix checks, without decoding it.
+
+    Returns:
+        str: "bytes", "file", "image", "pixels", "url", "base64", "file_path" or "unknown".
+    """
+    if isinstance(input_value, (bytes, bytearray, memoryview)):
+        return "bytes"
+    if isinstance(input_value, Image.Image):
+        return "image"
+    if isinstance(input_value, np.ndarray):
+        return "pixels"
+    if hasattr(input_value, "read"):
+        return "file"
+    if not isinstance(input_value, str):
+        return "unknown"
+
+    if input_value.startswith(("http://", "https://")) and not any(c.isspace() for c in input_value):
+        return "url"
+
+    # every ship is a PNG, so a base64 ship starts with the encoded PNG signature
+    if input_value.startswith(BASE64_PNG_PREFIX):
+        return "base64"
 
     # Check if it's a valid file path (assuming it's on your server)
     if re.match(r'^[A-Za-z0-9_./-]*$', input_value):
         return "file_path"
 
-    # Check if it's a valid URL
-    # print(input_value)
-    url_pattern = re.compile(r'^https?://\S+$')
-    if url_pattern.match(input_value):
-    # url_pattern = re.compile(r'^https?://\S+$')
-    # if url_pattern.match(input_value):
-        return "url"
-
     # If none of the above, return "unknown"
     return "unknown"        
         
@@ -0,0 +1,166 @@
+# Compiled form of part_data: every part ID is interned to a small integer, its row in the
+# lookup arrays below, so analysis code can gather part properties with NumPy indexing
+# instead of string keyed dict lookups per part.
+
+import numpy as np
+
+import part_data
+
+IDS = tuple(part_data.parts) # row -> part ID
+INDEX = {part_id: row for row, part_id in enumerate(IDS)} # part ID -> row
+UNKNOWN = INDEX["cosmoteer.UNKNOWN"]
+ENGINE_ROOM = INDEX["cosmoteer.engine_room"]
+THRUSTER_BOOST = INDEX["cosmoteer.thruster_boost"] # a third of its thrust without boost
+
+MASS = np.array([part["mass"] for part in part_data.parts.values()], np.float64)
+SIZE = np.array([part["size"] for part in part_data.parts.values()], np.int64)
+# size once rotated, ROTATED_SIZE[row, rotation] is (width, height)
+ROTATED_SIZE = np.stack([SIZE, SIZE[:, ::-1], SIZE, SIZE[:, ::-1]], axis=1)
+# size of the sprite in tiles, the tile size for parts whose sprite does not overflow it
+SPRITE_SIZE = np.array([part.get("sprite_size", part["size"]) for part in part_data.parts.values()], np.float64)
+THRUST = np.array([part_data.thruster_data.get(part_id, {"thrust": 0})["thrust"] for part_id in IDS], np.float64)
+IS_THRUSTER = np.array([part_id in part_data.thruster_data for part_id in IDS], bool)
+
+# sprites overflowing the tiles of their part, the overflow is drawn on one side only
+UP_TURRET_PARTS = (
+    "cosmoteer.laser_blaster_small",
+    "cosmoteer.laser_blaster_large",
+    "cosmoteer.disruptor",
+    "cosmoteer.ion_beam_emitter",
+    "cosmoteer.ion_beam_prism",
+    "cosmoteer.point_defense",
+    "cosmoteer.cannon_med",
+    "cosmoteer.cannon_large",
+    "cosmoteer.cannon_deck",
+    "cosmoteer.missile_launcher",
+    "cosmoteer.railgun_launcher",
+    "cosmoteer.flak_cannon_large",
+    "cosmoteer.shield_gen_small",
+)
+DOWN_TURRET_PARTS = (
+    "cosmoteer.thruster_small",
+    "cosmoteer.thruster_med",
+    "cosmoteer.thruster_large",
+    "cosmoteer.thruster_huge",
+    "cosmoteer.thruster_boost",
+)
+# offsets in tiles of the sprites of multi nozzle thrusters, per rotation
+MULTIPLE_TURRET_OFFSETS = {
+    "cosmoteer.thruster_small_2way": ((0, 0), (-1, 0), (-1, -1), (0, -1)),
+    "cosmoteer.thruster_small_3way": ((-1, 0), (-1, -1), (-1, -1), (0, -1)),
+}
+
+# legacy part IDs of classic ships -> (current ID, forced FlipX or None)
+LEGACY_IDS = {
+    "cosmoteer.ammo_factory": ("cosmoteer.factory_ammo", None),
+    "cosmoteer.missile_factory_nuke": ("cosmoteer.factory_nuke", None),
+    "cosmoteer.missile_factory_he": ("cosmoteer.factory_he", None),
+    "cosmoteer.electro_bolter": ("cosmoteer.disruptor", None),
+}
+for _part_id in ("cosmoteer.structure_1x2_wedge", "cosmoteer.structure_1x3_wedge",
+                 "cosmoteer.armor_1x2_wedge", "cosmoteer.armor_1x3_wedge"):
+    LEGACY_IDS[_part_id + "_L"] = (_part_id, 0)
+    LEGACY_IDS[_part_id + "_R"] = (_part_id, 1)
+
+
+def compile_sprite_tables():
+    """
+    Compile the sprite placement rules into SPRITE_OFFSET, the (x, y) shift in tiles of the
+    sprite of each row for each rotation.
+    """
+    sprite_offset = np.zeros((len(IDS), 4, 2), np.float64)
+    for row, part_id in enumerate(IDS):
+        if "sprite_size" not in part_data.parts[part_id]:
+            continue
+        overflow = SPRITE_SIZE[row, 1] - SIZE[row, 1]
+        if part_id in UP_TURRET_PARTS:
+            sprite_offset[row, 0] = (0, -overflow)
+            sprite_offset[row, 3] = (-overflow, 0)
+        elif part_id in DOWN_TURRET_PARTS:
+            sprite_offset[row, 1] = (-overflow, 0)
+            sprite_offset[row, 2] = (0, -overflow)
+        elif part_id in MULTIPLE_TURRET_OFFSETS:
+            sprite_offset[row] = MULTIPLE_TURRET_OFFSETS[part_id]
+    return sprite_offset
+
+SPRITE_OFFSET = compile_sprite_tables()
+
+LATERAL_THRUST = 0.05 # share of a thruster's thrust also given to the two directions beside it
+
+def compile_thruster_tables():
+    """
+    Compile part_data.thruster_data into flat per rotation tables of thrust points.
+
+    The thrust points of row t rotated r quarter turns are the entries COT_START[t * 4 + r]
+    to COT_START[t * 4 + r] + COT_COUNT[t * 4 + r] of the other arrays: the offset from the
+    part location, the direction the thrust pushes and the thrust. The lateral points at
+    LATERAL_THRUST follow the main ones.
+
+    Returns:
+        tuple: COT_START, COT_COUNT, COT_X, COT_Y, COT_ORIENTATION and COT_THRUST.
+    """
+    start, count, xs, ys, orientations, thrusts = [], [], [], [], [], []
+    for row, part_id in enumerate(IDS):
+        thruster = part_data.thruster_data.get(part_id)
+        width, height = SIZE[row].tolist()
+        for rotation in range(4):
+            start.append(len(xs))
+            if thruster is None:
+                count.append(0)
+                continue
+            main = []
+            for cot_x, cot_y, cot_orientation in thruster["cot"]:
+                # offset of the point once the part is rotated, relative to its upper left corner
+                x, y = [
+                    (cot_x, cot_y),
+                    (height - cot_y, cot_x),
+                    (width - cot_x, height - cot_y),
+                    (cot_y, width - cot_x),
+                ][rotation]
+                main.append((x, y, (rotation + cot_orientation) % 4, thruster["thrust"]))
+            lateral = []
+            for x, y, orientation, thrust in main:
+                lateral.append((x, y, (orientation + 1) % 4, thrust * LATERAL_THRUST))
+                lateral.append((x, y, (orientation + 3) % 4, thrust * LATERAL_THRUST))
+            for x, y, orientation, thrust in main + lateral:
+                xs.append(x)
+                ys.append(y)
+                orientations.append(orientation)
+                thrusts.append(thrust)
+            count.append(len(main) + len(lateral))
+    return (np.array(start, np.intp), np.array(count, np.intp), np.array(xs, np.float64),
+            np.array(ys, np.float64), np.array(orientations, np.intp), np.array(thrusts, np.float64))
+
+COT_START, COT_COUNT, COT_X, COT_Y, COT_ORIENTATION, COT_THRUST = compile_thruster_tables()
+
+
+def resolve(part_ids):
+    """
+    Resolve part IDs, legacy ones included, to rows.
+
+    Args:
+        part_ids (iterable): Part IDs, typically the distinct IDs of a ship.
+
+    Returns:
+        tuple: For each ID its row (UNKNOWN when it is not known), the FlipX it forces
+        (-1 when it keeps its own), whether it is a legacy ID, and the set of unknown IDs.
+    """
+    rows, flips, legacy, unknown = [], [], [], set()
+    for part_id in part_ids:
+        row = INDEX.get(part_id)
+        flip = -1
+        is_legacy = False
+        if row is None:
+            current = LEGACY_IDS.get(part_id)
+            if current is None:
+                row = UNKNOWN
+                unknown.add(part_id)
+            else:
+                row = INDEX[current[0]]
+                flip = -1 if current[1] is None else current[1]
+                is_legacy = True
+        rows.append(row)
+        flips.append(flip)
+        legacy.append(is_legacy)
+    return np.array(rows, np.intp), np.array(flips, np.int8), np.array(legacy, bool), unknown
+
@@ -0,0 +1,37 @@
+import collections
+
+import ship_cache
+
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024 # memory budget of a RenderCache, a large ship layer is about 8 MiB
+
+# the dimmed sprites of a ship, image[0, 0] is the pixel at (left, top) from the ship origin
+Layer = collections.namedtuple("Layer", ["image", "left", "top"])
+
+
+class RenderCache(ship_cache.BoundedLRU):
+    """
+    LRU cache of rendered base layers, the part of a ship drawing that does not depend on
+    the drawing flags.
+
+    Keys are built by the caller from the ship payload hash and the scale, see
+    center_of_mass.draw_ship. Layers are stored read only and shared between hits, callers
+    copy them onto their own canvas.
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES) -> None:
+        """
+        Args:
+            max_bytes (int, optional): Memory budget, least recently used layers are evicted
+                past it. Defaults to DEFAULT_MAX_BYTES.
+        """
+        super().__init__(max_bytes, size_of=lambda layer: layer.image.nbytes)
+
+    def put(self, key, layer) -> None:
+        """
+        Store a layer, its image is made read only.
+
+        Args:
+            key (hashable): Key of the layer.
+            layer (Layer): The rendered layer.
+        """
+        layer.image.flags.writeable = False
+        super().put(key, layer)
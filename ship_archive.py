@@ -0,0 +1,280 @@
+import argparse
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+
+import numpy as np
+
+import cosmoteer_save_tools
+import ship_batch
+
+MAGIC = b"SHIPARC1"
+HEADER_LENGTH = struct.Struct("<Q") # size of the JSON header that follows the magic
+ALIGNMENT = 64 # every column starts on a multiple of this, so the mapped arrays are aligned
+
+# concatenated part tables of all ships, rows of ship i are part_offsets[i]:part_offsets[i + 1]
+PART_COLUMNS = {
+    "part_type": np.uint16, # index into the archive wide type_names
+    "part_x": np.int32,
+    "part_y": np.int32,
+    "part_rotation": np.int8,
+    "part_flip_x": np.bool_,
+}
+STRING_COLUMNS = ("source", "name", "author") # stored as utf-8 bytes plus an offset column each
+SHIP_COLUMNS = {
+    "version": np.int8,
+    "flight_direction": np.int32,
+}
+# top level keys Ship has to decode for an archive entry
+ARCHIVE_FIELDS = ("Parts",) + cosmoteer_save_tools.METADATA_FIELDS
+
+
+def align(offset) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+class ArchiveWriter():
+    """
+    Write decoded ships to a ship archive one at a time.
+
+    Part columns are streamed to temporary files next to the archive and assembled into
+    it on close(), so memory use does not grow with the corpus.
+    """
+    def __init__(self, path) -> None:
+        self.path = path
+        self.type_names = []
+        self.type_lookup = {} # part ID -> index in type_names
+        self.part_count = 0
+        self.part_offsets = [0]
+        self.ship_columns = {name: [] for name in SHIP_COLUMNS}
+        self.strings = {name: [] for name in STRING_COLUMNS}
+        directory = os.path.dirname(os.path.abspath(path))
+        self.part_files = {name: tempfile.TemporaryFile(dir=directory) for name in PART_COLUMNS}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def add(self, source, version, data) -> None:
+        """
+        Append one ship.
+
+        Args:
+            source (str): Where the ship came from, usually its path.
+            version (int): Ship.version.
+            data (dict): Decoded data holding at least "Parts", as a PartTable or a list of
+                part dicts. Name, Author and FlightDirection are stored when present.
+        """
+        parts = data["Parts"]
+        if not isinstance(parts, cosmoteer_save_tools.PartTable):
+            parts = cosmoteer_save_tools.PartTable.from_list(parts)
+
+        # map the ship's own type indices onto the archive wide vocabulary
+        remap = np.empty(len(parts.type_names), np.uint16)
+        for i, name in enumerate(parts.type_names):
+            index = self.type_lookup.get(name)
+            if index is None:
+                index = self.type_lookup[name] = len(self.type_names)
+                self.type_names.append(name)
+            remap[i] = index
+        columns = {
+            "part_type": remap[parts.type_index],
+            "part_x": parts.x,
+            "part_y": parts.y,
+            "part_rotation": parts.rotation,
+            "part_flip_x": parts.flip_x,
+        }
+        for name, dtype in PART_COLUMNS.items():
+            self.part_files[name].write(np.ascontiguousarray(columns[name], dtype).tobytes())
+        self.part_count += len(parts)
+        self.part_offsets.append(self.part_count)
+
+        self.ship_columns["version"].append(version)
+        self.ship_columns["flight_direction"].append(data.get("FlightDirection", 0))
+        self.strings["source"].append(str(source))
+        self.strings["name"].append(data.get("Name", ""))
+        self.strings["author"].append(data.get("Author", ""))
+
+    def close(self) -> None:
+        """Write the header and the columns, then remove the temporary files."""
+        blobs = {} # in memory columns
+        for name, dtype in SHIP_COLUMNS.items():
+            blobs[name] = np.array(self.ship_columns[name], dtype)
+        blobs["part_offsets"] = np.array(self.part_offsets, np.int64)
+        for name in STRING_COLUMNS:
+            encoded = [text.encode("utf-8", "surrogateescape") for text in self.strings[name]]
+            blobs[name + "_offsets"] = np.concatenate(([0], np.cumsum([len(e) for e in encoded], dtype=np.int64)))
+            blobs[name + "_bytes"] = np.frombuffer(b"".join(encoded), np.uint8)
+
+        columns = {}
+        sizes = {}
+        for name, dtype in PART_COLUMNS.items():
+            columns[name] = {"dtype": np.dtype(dtype).str, "length": self.part_count}
+            sizes[name] = self.part_count * np.dtype(dtype).itemsize
+        for name, blob in blobs.items():
+            columns[name] = {"dtype": blob.dtype.str, "length": len(blob)}
+            sizes[name] = blob.nbytes
+
+        # offsets depend on the header size, which depends on the offsets, iterate until stable
+        header_size = 0
+        while True:
+            offset = align(len(MAGIC) + HEADER_LENGTH.size + header_size)
+            for name in columns:
+                columns[name]["offset"] = offset
+                offset = align(offset + sizes[name])
+            header = json.dumps({
+                "ships": len(self.part_offsets) - 1,
+                "parts": self.part_count,
+                "type_names": self.type_names,
+                "columns": columns,
+            }).encode()
+            if len(header) <= header_size:
+                break
+            header_size = len(header)
+        header = header.ljust(header_size)
+
+        with open(self.path, "wb") as f:
+            f.write(MAGIC)
+            f.write(HEADER_LENGTH.pack(header_size))
+            f.write(header)
+            for name in columns:
+                f.write(b"\0" * (columns[name]["offset"] - f.tell()))
+                if name in self.part_files:
+                    part_file = self.part_files[name]
+                    part_file.seek(0)
+                    shutil.copyfileobj(part_file, f)
+                else:
+                    f.write(blobs[name].tobytes())
+        self.discard()
+
+    def discard(self) -> None:
+        for part_file in self.part_files.values():
+            part_file.close()
+
+
+def write_archive(path, records) -> int:
+    """
+    Write a ship archive from ShipRecords, for example the output of ship_batch.decode_many.
+
+    Records with an error are skipped.
+
+    Args:
+        path (str): Path of the archive to create.
+        records (iterable): ShipRecords, or any (path, version, data, error) tuples.
+
+    Returns:
+        int: Number of ships written.
+    """
+    count = 0
+    with ArchiveWriter(path) as writer:
+        for source, version, data, error in records:
+            if error is None:
+                writer.add(source, version, data)
+                count += 1
+    return count
+
+
+class ShipArchive():
+    """
+    Read only, memory mapped view of a ship archive.
+
+    Opening an archive only parses its header, every column is a NumPy array backed by the
+    mapping and pages are read from disk when they are touched.
+
+    Attributes:
+        type_names (list): Part IDs, part_type indexes into it.
+        columns (dict): Name -> NumPy array of every column, for example columns["part_x"].
+    """
+    def __init__(self, path) -> None:
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a ship archive")
+        header_size, = HEADER_LENGTH.unpack_from(self._mmap, len(MAGIC))
+        start = len(MAGIC) + HEADER_LENGTH.size
+        header = json.loads(bytes(self._mmap[start:start + header_size]))
+        self.type_names = header["type_names"]
+        self.part_count = header["parts"]
+        self.columns = {
+            name: np.frombuffer(self._mmap, np.dtype(column["dtype"]), column["length"], column["offset"])
+            for name, column in header["columns"].items()
+        }
+        self.part_offsets = self.columns["part_offsets"]
+        self.version = self.columns["version"]
+        self.flight_direction = self.columns["flight_direction"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        # arrays still pointing into the mapping keep it alive
+        self.columns = {}
+        self.part_offsets = self.version = self.flight_direction = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+    def __len__(self) -> int:
+        return len(self.part_offsets) - 1
+
+    def string(self, column, i) -> str:
+        """Return entry i of a string column: "source", "name" or "author"."""
+        offsets = self.columns[column + "_offsets"]
+        data = self.columns[column + "_bytes"][offsets[i]:offsets[i + 1]]
+        return data.tobytes().decode("utf-8", "surrogateescape")
+
+    def parts(self, i) -> cosmoteer_save_tools.PartTable:
+        """Return the parts of ship i as a PartTable of views into the archive."""
+        start, end = self.part_offsets[i], self.part_offsets[i + 1]
+        return cosmoteer_save_tools.PartTable(
+            self.type_names,
+            self.columns["part_type"][start:end],
+            self.columns["part_x"][start:end],
+            self.columns["part_y"][start:end],
+            self.columns["part_rotation"][start:end],
+            self.columns["part_flip_x"][start:end],
+        )
+
+    def ship(self, i) -> dict:
+        """
+        Return ship i shaped like Ship(..., fields=ARCHIVE_FIELDS, part_table=True).data.
+        """
+        return {
+            "Name": self.string("name", i),
+            "Author": self.string("author", i),
+            "FlightDirection": int(self.flight_direction[i]),
+            "Parts": self.parts(i),
+        }
+
+
+if(__name__ == "__main__"):
+    parser = argparse.ArgumentParser(description="Decode ship.png files into a columnar ship archive.")
+    parser.add_argument("archive", help="archive file to create")
+    parser.add_argument("inputs", nargs="+", help="ship.png files or folders containing them")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of processes, defaults to the number of cores")
+    args = parser.parse_args()
+
+    def report_errors(records):
+        for record in records:
+            if record.error is not None:
+                print(f"{record.path}: {record.error}", file=sys.stderr)
+            yield record
+
+    records = ship_batch.decode_many(ship_batch.find_ships(args.inputs), workers=args.workers,
+                                     fields=ARCHIVE_FIELDS, part_table=True)
+    count = write_archive(args.archive, report_errors(records))
+    print(f"wrote {count} ships to {args.archive}")
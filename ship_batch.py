@@ -0,0 +1,111 @@
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import sys
+
+import cosmoteer_save_tools
+
+# one decoded ship: data is None and error holds "ExceptionType: message" when decoding failed
+ShipRecord = collections.namedtuple("ShipRecord", ["path", "version", "data", "error"])
+
+TASKS_PER_WORKER = 4 # ships queued per worker, enough to keep them busy without buffering a whole folder
+
+
+def decode_record(path, options) -> ShipRecord:
+    """
+    Decode one ship into a ShipRecord, capturing any error instead of raising it.
+
+    Args:
+        path (str): Path of the ship.png.
+        options (dict): Keyword arguments for cosmoteer_save_tools.Ship.
+
+    Returns:
+        ShipRecord: The decoded record.
+    """
+    try:
+        ship = cosmoteer_save_tools.Ship(path, **options)
+    except Exception as e:
+        return ShipRecord(path, None, None, f"{type(e).__name__}: {e}")
+    return ShipRecord(path, ship.version, ship.data, None)
+
+
+def decode_many(paths, workers=None, **options):
+    """
+    Decode many ships in a process pool, yielding records in completion order.
+
+    A bad file yields a record with its error and does not stop the batch. Only the decoded
+    data is sent back from the workers, pass fields or part_table to keep it small.
+
+    Args:
+        paths (iterable): Paths of the ship.png files.
+        workers (int, optional): Number of processes. Defaults to os.cpu_count(), 1 decodes
+            in this process.
+        **options: Keyword arguments for cosmoteer_save_tools.Ship, for example
+            fields=["Parts", "FlightDirection"] or part_table=True.
+
+    Yields:
+        ShipRecord: One record per path.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        for path in paths:
+            yield decode_record(path, options)
+        return
+
+    paths = iter(paths)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        while True:
+            # top the queue up lazily, so a huge folder is never submitted all at once
+            for path in paths:
+                pending.add(executor.submit(decode_record, path, options))
+                if len(pending) >= workers * TASKS_PER_WORKER:
+                    break
+            if not pending:
+                return
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def find_ships(inputs):
+    """
+    Expand files and folders into ship.png paths, folders are searched recursively.
+    """
+    for name in inputs:
+        if os.path.isdir(name):
+            for root, _, files in os.walk(name):
+                for file in sorted(files):
+                    if file.lower().endswith(".png"):
+                        yield os.path.join(root, file)
+        else:
+            yield name
+
+
+class RecordEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, bytes):
+            # same convention as JSONEncoderWithBytes in cosmoteer_save_tools
+            return {'__bytes__': obj.decode('latin1')}
+        if isinstance(obj, cosmoteer_save_tools.PartTable):
+            return obj.to_list()
+        return json.JSONEncoder.default(self, obj)
+
+
+if(__name__ == "__main__"):
+    parser = argparse.ArgumentParser(description="Decode ship.png files in parallel and print one JSON record per line.")
+    parser.add_argument("inputs", nargs="+", help="ship.png files or folders containing them")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of processes, defaults to the number of cores")
+    parser.add_argument("-f", "--fields", nargs="*", default=list(cosmoteer_save_tools.METADATA_FIELDS),
+                        help="top level keys to decode, pass no value to decode everything")
+    args = parser.parse_args()
+
+    fields = args.fields or None
+    failed = 0
+    for record in decode_many(find_ships(args.inputs), workers=args.workers, fields=fields):
+        failed += record.error is not None
+        print(json.dumps(record._asdict(), cls=RecordEncoder))
+    sys.exit(1 if failed else 0)
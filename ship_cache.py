@@ -0,0 +1,214 @@
+import collections
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024 # memory budget of a ShipCache, in pickled bytes
+
+
+class BoundedLRU():
+    """
+    Thread safe least recently used mapping with a memory budget.
+
+    Values are weighed with size_of, the least recently used ones are evicted once the
+    total goes past max_bytes. Shared by ShipCache and render_cache.RenderCache.
+    """
+    def __init__(self, max_bytes, size_of=len) -> None:
+        """
+        Args:
+            max_bytes (int): Memory budget.
+            size_of (callable, optional): Size in bytes of a value. Defaults to len.
+        """
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def get(self, key):
+        """
+        Return the value stored under key and mark it as recently used, or None on a miss.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        """
+        Store a value, evicting the least recently used ones past the budget.
+        """
+        size = self.size_of(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= self.size_of(old)
+            if size > self.max_bytes:
+                return # would evict everything else and still not fit
+            self._entries[key] = value
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= self.size_of(evicted)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop every entry, the counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        """
+        Counters for monitoring.
+
+        Returns:
+            dict: hits, misses, evictions, entries and bytes.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.size,
+            }
+
+
+class ShipCache():
+    """
+    Content-addressed LRU cache of decoded ships.
+
+    Entries are keyed by a hash of the compressed ship payload, so the same ship uploaded
+    twice (even re-saved with a different PNG compression) is only decoded once. Values are
+    stored pickled: the memory budget counts real bytes and every hit returns a fresh copy
+    that the caller is free to modify.
+
+    Only load a disk tier written by a trusted process, entries are unpickled.
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, directory=None) -> None:
+        """
+        Args:
+            max_bytes (int, optional): Memory budget, least recently used entries are evicted
+                past it. Defaults to DEFAULT_MAX_BYTES.
+            directory (str, optional): Directory of the on-disk tier. Entries are written there
+                when stored and read back on a memory miss. Defaults to no disk tier.
+        """
+        self.directory = directory
+        self.disk_hits = 0
+        self._memory = BoundedLRU(max_bytes) # pickled blobs
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(compressed, fields=None, part_table=False) -> str:
+        """
+        Build the cache key of a ship.
+
+        Args:
+            compressed (bytes): The compressed payload hidden in the ship.png.
+            fields (iterable, optional): Projected fields the ship was decoded with.
+            part_table (bool, optional): Whether the parts were decoded as a PartTable.
+
+        Returns:
+            str: Hex digest identifying the decoded data.
+        """
+        digest = hashlib.sha256(compressed)
+        # projected and columnar decodes hold different data than a full decode
+        if fields is not None:
+            digest.update(b"\0fields\0" + "\0".join(sorted(fields)).encode())
+        if part_table:
+            digest.update(b"\0part_table")
+        return digest.hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._memory)
+
+    def __contains__(self, key) -> bool:
+        return key in self._memory or (self.directory is not None and os.path.exists(self._path(key)))
+
+    def _path(self, key) -> str:
+        return os.path.join(self.directory, key + ".pickle")
+
+    def get(self, key):
+        """
+        Look a ship up, checking memory first and then the disk tier.
+
+        Args:
+            key (str): Key built by make_key.
+
+        Returns:
+            The decoded data, or None on a miss.
+        """
+        blob = self._memory.get(key)
+        if blob is not None:
+            return pickle.loads(blob)
+
+        if self.directory is not None:
+            try:
+                with open(self._path(key), "rb") as f:
+                    blob = f.read()
+            except FileNotFoundError:
+                pass
+            else:
+                with self._lock:
+                    self.disk_hits += 1
+                self._memory.put(key, blob)
+                return pickle.loads(blob)
+        return None
+
+    def put(self, key, data) -> None:
+        """
+        Store a decoded ship.
+
+        Args:
+            key (str): Key built by make_key.
+            data: The decoded data, it must be picklable.
+        """
+        blob = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+        self._memory.put(key, blob)
+
+        if self.directory is not None and not os.path.exists(self._path(key)):
+            # write to a temporary file first so readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(blob)
+                os.replace(tmp_path, self._path(key))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+    def clear(self) -> None:
+        """Drop the in-memory entries, the disk tier and the counters are kept."""
+        self._memory.clear()
+
+    def stats(self) -> dict:
+        """
+        Counters for monitoring.
+
+        Returns:
+            dict: hits, disk_hits, misses, evictions, entries and bytes.
+        """
+        stats = self._memory.stats()
+        with self._lock:
+            stats["disk_hits"] = self.disk_hits
+        # a disk hit first missed in memory
+        stats["misses"] -= stats["disk_hits"]
+        return stats
@@ -0,0 +1,129 @@
+import asyncio
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+FETCH_TIMEOUT = (5, 30) # seconds to connect and between received bytes
+MAX_DOWNLOAD_SIZE = 16 * 1024 * 1024 # ship.png files are a few hundred KB
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+POOL_SIZE = 16 # kept-alive connections per host
+
+
+class DownloadTooLargeError(ValueError):
+    """Raised when a download grows past its size limit."""
+
+
+_session = None
+_session_lock = threading.Lock()
+_async_session = None
+_async_session_loop = None # an aiohttp session only works in the event loop that created it
+
+
+def get_session() -> requests.Session:
+    """
+    Return the requests session shared by every fetch, so connections are pooled and kept alive.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def check_content_length(headers, max_size) -> None:
+    # refuse oversized downloads before reading the body when the server announces the size
+    length = headers.get("Content-Length")
+    if length is not None and length.isdigit() and int(length) > max_size:
+        raise DownloadTooLargeError(f"download is {length} bytes, more than {max_size}")
+
+
+def fetch(url, max_size=None, timeout=None) -> bytes:
+    """
+    Download a url through the shared session, streaming the body and aborting past max_size.
+
+    Args:
+        url (str): The url to download.
+        max_size (int, optional): Maximum size of the body. Defaults to MAX_DOWNLOAD_SIZE.
+        timeout (float or tuple, optional): requests timeout, (connect, read) in seconds.
+            Defaults to FETCH_TIMEOUT.
+
+    Returns:
+        bytes: The response body.
+
+    Raises:
+        DownloadTooLargeError: If the body is larger than max_size.
+        requests.HTTPError: If the server answers with an error status.
+    """
+    if max_size is None:
+        max_size = MAX_DOWNLOAD_SIZE
+    if timeout is None:
+        timeout = FETCH_TIMEOUT
+    with get_session().get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        check_content_length(response.headers, max_size)
+        body = bytearray()
+        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+            body += chunk
+            if len(body) > max_size:
+                raise DownloadTooLargeError(f"download is more than {max_size} bytes")
+    return bytes(body)
+
+
+async def fetch_async(url, max_size=None, timeout=None, session=None) -> bytes:
+    """
+    Download a url with aiohttp, streaming the body and aborting past max_size.
+
+    Args:
+        url (str): The url to download.
+        max_size (int, optional): Maximum size of the body. Defaults to MAX_DOWNLOAD_SIZE.
+        timeout (aiohttp.ClientTimeout, optional): Defaults to FETCH_TIMEOUT.
+        session (aiohttp.ClientSession, optional): Session to use. Defaults to one shared
+            session, created on first use in the running event loop and replaced when called
+            from another loop.
+
+    Returns:
+        bytes: The response body.
+
+    Raises:
+        DownloadTooLargeError: If the body is larger than max_size.
+        aiohttp.ClientResponseError: If the server answers with an error status.
+    """
+    import aiohttp # only needed by async callers such as the bot
+
+    global _async_session, _async_session_loop
+    if max_size is None:
+        max_size = MAX_DOWNLOAD_SIZE
+    if timeout is None:
+        timeout = aiohttp.ClientTimeout(sock_connect=FETCH_TIMEOUT[0], sock_read=FETCH_TIMEOUT[1])
+    if session is None:
+        loop = asyncio.get_running_loop()
+        if _async_session is None or _async_session.closed or _async_session_loop is not loop:
+            # a session left open by a loop that has since stopped cannot be closed anymore, drop it
+            _async_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit_per_host=POOL_SIZE))
+            _async_session_loop = loop
+        session = _async_session
+    async with session.get(url, timeout=timeout) as response:
+        response.raise_for_status()
+        check_content_length(response.headers, max_size)
+        body = bytearray()
+        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+            body += chunk
+            if len(body) > max_size:
+                raise DownloadTooLargeError(f"download is more than {max_size} bytes")
+    return bytes(body)
+
+
+async def close_async_session() -> None:
+    """Close the shared aiohttp session, call it before the event loop stops."""
+    global _async_session, _async_session_loop
+    if _async_session is not None:
+        if _async_session_loop is asyncio.get_running_loop():
+            await _async_session.close()
+        _async_session = None
+        _async_session_loop = None
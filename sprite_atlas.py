@@ -0,0 +1,168 @@
+import collections
+import os
+import threading
+
+import cv2
+import numpy as np
+
+SPRITE_DIRECTORY = "sprites"
+MAX_VARIANTS = 4096 # ready to blit sprites kept, about 80 part types x 4 rotations x 2 flips x a few scales
+MIPMAP_LEVELS = 4 # sprites are also kept at 1/2, 1/4 and 1/8 of their size
+MIN_RESIZE = 0.25 # smallest resize applied to a mipmap, what full size drawings apply to the sprite files
+
+
+class SpriteAtlas():
+    """
+    Part sprites decoded once with their mipmaps, plus a bounded LRU cache of ready to blit
+    variants.
+
+    Mipmaps are the sprites halved again and again with area interpolation. Small variants
+    are resized from the first level that keeps the resize at MIN_RESIZE or more, so
+    thumbnails average the sprite instead of skipping most of its pixels.
+
+    A variant is a sprite resized, flipped and rotated for one placement, stored as the
+    uint8 pair returned by premultiply() so blending it is a single multiply-add:
+    background * inverse_alpha / 255 + premultiplied_rgb.
+    """
+    def __init__(self, directory=SPRITE_DIRECTORY, max_variants=MAX_VARIANTS, mipmap_levels=MIPMAP_LEVELS) -> None:
+        """
+        Args:
+            directory (str, optional): Folder of the <part>.png sprites. Defaults to SPRITE_DIRECTORY.
+            max_variants (int, optional): Variants kept before the least recently used ones are
+                dropped. Defaults to MAX_VARIANTS.
+            mipmap_levels (int, optional): Sizes kept of each sprite, the full size included.
+                Defaults to MIPMAP_LEVELS.
+        """
+        self.directory = directory
+        self.max_variants = max_variants
+        self.sprites = {} # part ID -> BGRA sprite as decoded from disk
+        self.mipmaps = {} # part ID -> the sprite at full, half, quarter... size
+        for file_name in sorted(os.listdir(directory)):
+            if file_name.endswith(".png"):
+                sprite = cv2.imread(os.path.join(directory, file_name), cv2.IMREAD_UNCHANGED)
+                if sprite is not None and sprite.ndim == 3 and sprite.shape[2] == 4:
+                    part_id = "cosmoteer." + file_name[:-4]
+                    self.sprites[part_id] = sprite
+                    self.mipmaps[part_id] = build_mipmaps(sprite, mipmap_levels)
+        self.hits = 0
+        self.misses = 0
+        self._variants = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def variant(self, part_id, rotation, flipx, scale) -> tuple:
+        """
+        Return the sprite of a part ready to be blitted.
+
+        Args:
+            part_id (str): Part ID, for example "cosmoteer.armor".
+            rotation (int): 0, 1, 2 or 3 quarter turns clockwise.
+            flipx (bool): Whether the sprite is mirrored before being rotated.
+            scale (float): Size of the variant relative to the sprite file.
+
+        Returns:
+            tuple: premultiplied_rgb and inverse_alpha uint8 arrays, both of shape (h, w, 3).
+        """
+        key = (part_id, rotation, bool(flipx), scale)
+        with self._lock:
+            variant = self._variants.get(key)
+            if variant is not None:
+                self._variants.move_to_end(key)
+                self.hits += 1
+                return variant
+            self.misses += 1
+
+        sprite = self.sprites[part_id]
+        size = (max(1, round(sprite.shape[1] * scale)), max(1, round(sprite.shape[0] * scale)))
+        mipmaps = self.mipmaps[part_id]
+        level = 0 # resize from mipmaps[level], that is by scale * 2 ** level
+        while scale * 2 ** level < MIN_RESIZE and level + 1 < len(mipmaps):
+            level += 1
+        variant = premultiply(rotate_sprite(cv2.resize(mipmaps[level], size), rotation, flipx))
+
+        with self._lock:
+            self._variants[key] = variant
+            while len(self._variants) > self.max_variants:
+                self._variants.popitem(last=False)
+        return variant
+
+    def stats(self) -> dict:
+        """Counters for monitoring: hits, misses and cached variants."""
+        return {"hits": self.hits, "misses": self.misses, "variants": len(self._variants)}
+
+
+def build_mipmaps(sprite, levels) -> list:
+    """
+    Return the sprite followed by up to levels - 1 copies, each half the size of the previous one.
+    """
+    mipmaps = [sprite]
+    while len(mipmaps) < levels and min(mipmaps[-1].shape[:2]) >= 2:
+        previous = mipmaps[-1]
+        size = (previous.shape[1] // 2, previous.shape[0] // 2)
+        mipmaps.append(cv2.resize(previous, size, interpolation=cv2.INTER_AREA))
+    return mipmaps
+
+
+def rotate_sprite(image, angle, flipx):
+    """
+    Rotate an image by quarter turns clockwise, mirroring it first if flipx is set.
+    """
+    if flipx:
+        image = np.fliplr(image)
+    if angle in (1, 2, 3):
+        return np.rot90(image, 4 - angle)
+    return image
+
+
+def premultiply(sprite) -> tuple:
+    """
+    Split a BGRA uint8 sprite into the premultiplied form blit() takes.
+
+    Args:
+        sprite (numpy.ndarray): BGRA sprite of shape (h, w, 4).
+
+    Returns:
+        tuple: premultiplied_rgb, rgb * alpha / 255 rounded, and inverse_alpha, 255 - alpha
+        repeated over the three channels, as contiguous uint8 arrays of shape (h, w, 3).
+    """
+    alpha = np.repeat(sprite[:, :, 3:].astype(np.uint16), 3, axis=2)
+    premultiplied = (sprite[:, :, :3] * alpha + 127) // 255
+    return premultiplied.astype(np.uint8), (255 - alpha).astype(np.uint8)
+
+
+def blit(background, variant, x, y) -> bool:
+    """
+    Blend a variant onto a uint8 BGR background with its upper left corner at (x, y).
+
+    The blend stays in uint8, with cv2 rounding and saturating every channel at once.
+
+    Args:
+        background (numpy.ndarray): The image drawn on, modified in place.
+        variant (tuple): As returned by SpriteAtlas.variant or premultiply.
+        x (int): Column of the upper left corner.
+        y (int): Row of the upper left corner.
+
+    Returns:
+        bool: False if the sprite does not fit and nothing was drawn.
+    """
+    premultiplied, inverse_alpha = variant
+    height, width = inverse_alpha.shape[:2]
+    if y + height > background.shape[0] or x + width > background.shape[1]:
+        return False
+    region = background[y:y + height, x:x + width]
+    cv2.add(cv2.multiply(region, inverse_alpha, scale=1 / 255), premultiplied, dst=region)
+    return True
+
+
+_default_atlas = None
+_default_lock = threading.Lock()
+
+def default_atlas() -> SpriteAtlas:
+    """
+    Return the process wide atlas of SPRITE_DIRECTORY, loading it on first use.
+    """
+    global _default_atlas
+    if _default_atlas is None:
+        with _default_lock:
+            if _default_atlas is None:
+                _default_atlas = SpriteAtlas()
+    return _default_atlas
@@ -3,6 +3,7 @@ import discord
 from discord import app_commands
 import secret_token
 import center_of_mass
+import sprite_atlas
 import asyncio
 
 intents = discord.Intents.default()
@@ -35,6 +36,7 @@ help_text="""/version: """+version_text+"""
 @client.event
 async def on_ready():
     await client.change_presence(activity=discord.Game(name="Cosmoteer (/help)"))
+    sprite_atlas.default_atlas() # decode the sprites now instead of during the first /com
     print("Syncing slash commands")
     await tree.sync()
     print("Guilds:")